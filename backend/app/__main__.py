@@ -0,0 +1,32 @@
+# app/__main__.py
+"""
+Entrypoint: `python -m app` (run from backend/).
+Uses uvloop (and httptools) when installed; uvicorn falls back to stdlib asyncio/h11 otherwise.
+"""
+from __future__ import annotations
+
+import os
+
+import uvicorn
+
+try:
+    import uvloop  # noqa: F401
+    _LOOP = "uvloop"
+except Exception:
+    _LOOP = "asyncio"
+
+try:
+    import httptools  # noqa: F401
+    _HTTP = "httptools"
+except Exception:
+    _HTTP = "h11"
+
+
+if __name__ == "__main__":
+    uvicorn.run(
+        "app.main:app",
+        host=os.getenv("HOST", "127.0.0.1"),
+        port=int(os.getenv("PORT", "8000")),
+        loop=_LOOP,
+        http=_HTTP,
+    )
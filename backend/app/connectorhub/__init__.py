@@ -1,10 +1,13 @@
 # app/connectorhub/__init__.py
 from __future__ import annotations
 import asyncio, logging, time
+import httpx
 from typing import List, Tuple, Dict, Any
+from pydantic import ValidationError
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.schemas import NormalizedCandidate
+from app.schemas import CANDIDATE_LIST, NormalizedCandidate
+from app.services.deadline import reset_deadline, set_deadline
 
 # Adapters (optional if not present)
 try:
@@ -20,9 +23,37 @@ try:
 except Exception:
     github_adapter = None
 
+# Caps in-flight provider calls as more adapters are added.
+# Built lazily per event loop: asyncio primitives bind to the first loop that waits on them.
+_SEM: asyncio.Semaphore | None = None
+_SEM_LOOP: asyncio.AbstractEventLoop | None = None
+
+
+def _provider_sem() -> asyncio.Semaphore:
+    global _SEM, _SEM_LOOP
+    loop = asyncio.get_running_loop()
+    if _SEM is None or _SEM_LOOP is not loop:
+        _SEM, _SEM_LOOP = asyncio.Semaphore(8), loop
+    return _SEM
+
+
+def new_http_client() -> httpx.AsyncClient:
+    """One pooled client shared by every adapter (built once in the app lifespan)."""
+    return httpx.AsyncClient(
+        timeout=httpx.Timeout(10.0, connect=1.0),
+        limits=httpx.Limits(max_connections=64, max_keepalive_connections=32),
+        headers={"User-Agent": "OneSource/1"},
+    )
+
 
 async def _call_with_timeout(coro, timeout_s: float):
-    return await asyncio.wait_for(coro, timeout=timeout_s)
+    # Expose the same budget to the adapter so retries/backoffs can stay inside it
+    token = set_deadline(timeout_s)
+    try:
+        async with asyncio.timeout(timeout_s):
+            return await coro
+    finally:
+        reset_deadline(token)
 
 
 def _coerce_candidates(raw: List[Any]) -> List[NormalizedCandidate]:
@@ -30,11 +61,29 @@ def _coerce_candidates(raw: List[Any]) -> List[NormalizedCandidate]:
     Adapters should return List[NormalizedCandidate]. If any returns dicts with the same keys,
     coerce them, otherwise drop and log.
     """
-    coerced: List[NormalizedCandidate] = []
-    for item in raw or []:
+    items = raw or []
+    # Fast path: adapters normally return exact NormalizedCandidate instances
+    cls = NormalizedCandidate
+    coerced = [x for x in items if type(x) is cls]
+    if len(coerced) == len(items):
+        return coerced
+
+    # Validate all dict rows in one adapter call; on any failure fall back to per-row
+    # so a single bad row only drops itself
+    rows = [x for x in items if isinstance(x, dict) and "source" in x and "url" in x and "doc_id" in x]
+    try:
+        validated = iter(CANDIDATE_LIST.validate_python(rows)) if rows else None
+    except ValidationError:
+        validated = None
+
+    coerced = []
+    for item in items:
         if isinstance(item, NormalizedCandidate):
             coerced.append(item)
         elif isinstance(item, dict) and "source" in item and "url" in item and "doc_id" in item:
+            if validated is not None:
+                coerced.append(next(validated))
+                continue
             try:
                 coerced.append(NormalizedCandidate(**item))
             except Exception as e:
@@ -50,6 +99,8 @@ async def gather_candidates(
     query: str,
     limit: int = 5,
     timeout_each: float = 3.0,
+    *,
+    http: httpx.AsyncClient,
 ) -> Tuple[List[NormalizedCandidate], Dict[str, dict]]:
     """
     Run Slack/Drive/GitHub adapters in parallel.
@@ -69,15 +120,15 @@ async def gather_candidates(
         providers.append(("github", github_adapter.search_corpus))
 
     timings: Dict[str, dict] = {}
-    tasks = []
+    sem = _provider_sem()
 
-    for name, fn in providers:
-        async def runner(_name=name, _fn=fn):
-            info = {"ms": 0, "timeout": 0, "error": "", "rate_limited": 0}
+    async def runner(_name, _fn):
+        info = {"ms": 0, "timeout": 0, "error": "", "rate_limited": 0}
+        async with sem:
             t0 = time.perf_counter()
             try:
-                # Each adapter signature: (user_id, query, limit, db)
-                res = await _call_with_timeout(_fn(user_id, query, limit, db), timeout_each)
+                # Each adapter signature: (user_id, query, limit, db, *, http)
+                res = await _call_with_timeout(_fn(user_id, query, limit, db, http=http), timeout_each)
                 info["ms"] = int((time.perf_counter() - t0) * 1000)
                 # Some adapters might return a sentinel for rate limit (e.g., [{"rate_limited":1}])
                 if isinstance(res, list) and len(res) == 1 and isinstance(res[0], dict) and res[0].get("rate_limited"):
@@ -89,14 +140,15 @@ async def gather_candidates(
                 info["ms"] = int((time.perf_counter() - t0) * 1000)
                 return _name, [], info
             except Exception as e:
+                # Swallowed here so one failing adapter never aborts the TaskGroup
                 info["error"] = e.__class__.__name__
                 info["ms"] = int((time.perf_counter() - t0) * 1000)
                 logging.exception("provider_error name=%s", _name)
                 return _name, [], info
 
-        tasks.append(runner())
-
-    results = await asyncio.gather(*tasks) if tasks else []
+    async with asyncio.TaskGroup() as tg:
+        tasks = [tg.create_task(runner(name, fn)) for name, fn in providers]
+    results = [t.result() for t in tasks]
 
     merged: List[NormalizedCandidate] = []
     for name, res, info in results:
@@ -105,12 +157,13 @@ async def gather_candidates(
         timings[name] = info | {"count": len(coerced)}
         merged.extend(coerced)
 
-    # Helpful single-line summary in Uvicorn console
-    logging.info(
-        "connectorhub.summary %s",
-        {k: {"ms": v["ms"], "timeout": v["timeout"], "error": v["error"], "rate_limited": v.get("rate_limited", 0), "count": v.get("count", 0)}
-         for k, v in timings.items()}
-    )
+    # Helpful single-line summary in Uvicorn console (dict only built when INFO is on)
+    if logging.getLogger().isEnabledFor(logging.INFO):
+        logging.info(
+            "connectorhub.summary %s",
+            {k: {"ms": v["ms"], "timeout": v["timeout"], "error": v["error"], "rate_limited": v.get("rate_limited", 0), "count": v.get("count", 0)}
+             for k, v in timings.items()}
+        )
 
     # IMPORTANT: don't slice here; let Fusion see all candidates
     return merged, timings
@@ -1,39 +1,86 @@
 #drive.py
 from __future__ import annotations
-from typing import List, Optional
+from typing import Iterator, List, Optional
 from datetime import datetime
+from itertools import islice
+from types import MappingProxyType
 import os, httpx
 
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
 
 from app.models import Connection
-from app.deps import get_crypto
+from app.services.crypto import decrypt_str
 from app.schemas import NormalizedCandidate
+from app.services.jsonutil import loads
+from app.services.token_cache import get_cached_token, set_cached_token, invalidate_token
+
+# C-speed RFC3339 parsing when ciso8601 is installed; 3.11+ fromisoformat accepts "Z" natively
+try:
+    from ciso8601 import parse_rfc3339 as _parse_ts
+except Exception:
+    _parse_ts = datetime.fromisoformat
 
 DRIVE_FOLDER_ID = os.getenv("DRIVE_FOLDER_ID", "").strip()
 
+# Query-independent files.list params; copied per call, never mutated
+_BASE_PARAMS = MappingProxyType({
+    "fields": "files(id,name,mimeType,modifiedTime,webViewLink,owners(emailAddress,displayName)),nextPageToken",
+    "orderBy": "modifiedTime desc",
+    "supportsAllDrives": "true",
+    "includeItemsFromAllDrives": "true",
+})
 
-async def _get_token(db: AsyncSession) -> Optional[str]:
-    row = (await db.execute(
-        select(Connection).where(Connection.provider == "drive")
+async def _get_token(db: AsyncSession, user_id: int | None = None) -> Optional[str]:
+    cached = get_cached_token("drive", user_id)
+    if cached:
+        return cached
+    token_enc = (await db.execute(
+        select(Connection.access_token_enc).where(Connection.provider == "drive").limit(1)
     )).scalar_one_or_none()
-    if not row or not row.access_token_enc:
+    if not token_enc:
         return None
-    return get_crypto().decrypt(row.access_token_enc.encode()).decode()
+    token = decrypt_str(token_enc)
+    set_cached_token("drive", user_id, token)
+    return token
 
 
 def _parse_rfc3339(ts: str) -> datetime:
-    return datetime.fromisoformat(ts.replace("Z", "+00:00"))
+    return _parse_ts(ts)
+
+
+def _iter_files(data: dict) -> Iterator[NormalizedCandidate]:
+    for f in data.get("files", []):
+        url = f.get("webViewLink")
+        if not url:
+            continue
+        owners = f.get("owners", [])
+        owner = ""
+        if owners:
+            owner = owners[0].get("emailAddress") or owners[0].get("displayName") or ""
+
+        # Trusted API shape: model_construct skips per-row Pydantic validation
+        yield NormalizedCandidate.model_construct(
+            source="drive",
+            doc_id=f["id"],
+            url=url,
+            title=f.get("name", ""),
+            snippet=f"{f.get('name','')} — {f.get('mimeType','')}",
+            last_modified=_parse_rfc3339(f["modifiedTime"]),
+            owner=owner,
+            signals={"mime": f.get("mimeType", ""), "folder": "Runbooks"},
+        )
 
 
 async def search_corpus(
     user_id: int | None,
     query: str,
     limit: int,
-    db: AsyncSession
+    db: AsyncSession,
+    *,
+    http: httpx.AsyncClient,
 ) -> List[NormalizedCandidate]:
-    token = await _get_token(db)
+    token = await _get_token(db, user_id)
     if not token or not DRIVE_FOLDER_ID:
         return []
 
@@ -43,52 +90,33 @@ async def search_corpus(
         safe = query.replace("'", " ")
         q_parts.append(f"(name contains '{safe}' or fullText contains '{safe}')")
     q = " and ".join(q_parts)
-    params = {
-    "q": q,
-    "fields": "files(id,name,mimeType,modifiedTime,webViewLink,owners(emailAddress,displayName)),nextPageToken",
-    "pageSize": 25,
-    "orderBy": "modifiedTime desc",
-    "supportsAllDrives": "true",
-    "includeItemsFromAllDrives": "true",
-    }
-    fields = "files(id,name,mimeType,modifiedTime,webViewLink,owners(emailAddress,displayName)),nextPageToken"
+    params = dict(_BASE_PARAMS)
+    params["q"] = q
+    # Big enough that one round-trip normally covers `limit`
+    params["pageSize"] = min(1000, max(25, limit * 4))
 
     out: List[NormalizedCandidate] = []
     page_token = None
-    async with httpx.AsyncClient(timeout=10.0) as client:
-        while True:
-            if page_token:
-                params["pageToken"] = page_token
-
-            r = await client.get(
-                "https://www.googleapis.com/drive/v3/files",
-                params=params,
-                headers={"Authorization": f"Bearer {token}"},
-            )
-            if r.status_code != 200:
-                break
-            data = r.json()
-            for f in data.get("files", []):
-                owners = f.get("owners", [])
-                owner = ""
-                if owners:
-                    owner = owners[0].get("emailAddress") or owners[0].get("displayName") or ""
-
-                out.append(NormalizedCandidate(
-                    source="drive",
-                    doc_id=f["id"],
-                    url=f.get("webViewLink", ""),
-                    title=f.get("name", ""),
-                    snippet=f"{f.get('name','')} — {f.get('mimeType','')}",
-                    last_modified=_parse_rfc3339(f["modifiedTime"]),
-                    owner=owner,
-                    signals={"mime": f.get("mimeType", ""), "folder": "Runbooks"},
-                ))
-                if len(out) >= limit:
-                    return out
-
-            page_token = data.get("nextPageToken")
-            if not page_token:
-                break
+    while len(out) < limit:
+        page_params = {**params, "pageToken": page_token} if page_token else params
+        async with http.stream(
+            "GET",
+            "https://www.googleapis.com/drive/v3/files",
+            params=page_params,
+            headers={"Authorization": f"Bearer {token}"},
+        ) as r:
+            # Error bodies are never read or parsed
+            if r.status_code == 200:
+                data = loads(await r.aread())
+        if r.status_code == 401:
+            invalidate_token("drive", user_id)
+            break
+        if r.status_code != 200:
+            break
+        out.extend(islice(_iter_files(data), limit - len(out)))
+
+        page_token = data.get("nextPageToken")
+        if not page_token:
+            break
 
     return out
@@ -1,106 +1,112 @@
 from __future__ import annotations
-import os, asyncio, httpx
+import os, asyncio, httpx, logging, time
 from datetime import datetime, timezone
-from typing import List, Optional, Dict
+from typing import Iterator, List, Optional, Dict
+from itertools import islice
+from urllib.parse import quote_plus
 
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
 
-from app.deps import get_crypto
+from app.services.crypto import decrypt_str
 from app.models import Connection
 from app.schemas import NormalizedCandidate
+from app.services.jsonutil import loads
+from app.services.token_cache import get_cached_token, set_cached_token, invalidate_token
+from app.services.cache import TTLCache, github_cache, make_key
+
+log = logging.getLogger(__name__)
+
+# C-speed RFC3339 parsing when ciso8601 is installed; 3.11+ fromisoformat accepts "Z" natively
+try:
+    from ciso8601 import parse_rfc3339 as _parse_ts
+except Exception:
+    _parse_ts = datetime.fromisoformat
 
 GITHUB_API_URL = "https://api.github.com"
 GITHUB_ORG = os.getenv("GITHUB_ORG", "").strip()
 GITHUB_REPOS = [r.strip() for r in os.getenv("GITHUB_REPOS", "").split(",") if r.strip()]
 
+# ETag validators outlive github_cache entries so stale keys can be revalidated with a 304
+_ETAGS = TTLCache(ttl_seconds=3600, max_entries=1024)
+
+# Set from Retry-After; searches short-circuit as rate limited until then (monotonic clock)
+_RATE_LIMIT_UNTIL = 0.0
 
-async def _get_token(db: AsyncSession) -> Optional[str]:
-    row = (await db.execute(
-        select(Connection).where(Connection.provider == "github")
+# In-flight searches keyed like github_cache; concurrent identical queries share one request
+_INFLIGHT: Dict[str, asyncio.Task] = {}
+
+async def _get_token(db: AsyncSession, user_id: int | None = None) -> Optional[str]:
+    cached = get_cached_token("github", user_id)
+    if cached:
+        return cached
+    token_enc = (await db.execute(
+        select(Connection.access_token_enc).where(Connection.provider == "github").limit(1)
     )).scalar_one_or_none()
-    if not row or not row.access_token_enc:
+    if not token_enc:
         return None
-    return get_crypto().decrypt(row.access_token_enc.encode()).decode()
+    token = decrypt_str(token_enc)
+    set_cached_token("github", user_id, token)
+    return token
 
 
 def _iso(ts: Optional[str]) -> datetime:
     if not ts:
         return datetime.now(timezone.utc)
     try:
-        return datetime.fromisoformat(ts.replace("Z", "+00:00")).astimezone(timezone.utc)
+        return _parse_ts(ts).astimezone(timezone.utc)
     except Exception:
         return datetime.now(timezone.utc)
 
 
-def _build_q(user_q: str) -> str:
-    """
-    Scope the search to your org or repos to avoid public GitHub noise.
-    """
-    parts: List[str] = []
-    uq = (user_q or "").strip()
-    if uq:
-        parts.append(uq)
-    # doc-like bias
-    parts += ["in:file", "path:/docs", "filename:README.md"]
-
+def _scope_suffix() -> str:
+    # doc-like bias + org/repo scope
     if GITHUB_ORG:
-        parts.append(f"org:{GITHUB_ORG}")
+        scope = f"org:{GITHUB_ORG}"
     elif GITHUB_REPOS:
-        for repo in GITHUB_REPOS:
-            parts.append(f"repo:{repo}")
+        scope = " ".join(f"repo:{repo}" for repo in GITHUB_REPOS)
     else:
-        # Nothing to scope → skip adapter
         return ""
-    return " ".join(parts)
+    return f"in:file path:/docs filename:README.md {scope}"
 
 
-async def search_corpus(
-    user_id: int | None,
-    query: str,
-    limit: int,
-    db: AsyncSession
-) -> List[NormalizedCandidate]:
-    token = await _get_token(db)
-    if not token:
-        return []
+# Env is read once at import, so the scope never changes at runtime
+_SCOPE_SUFFIX = _scope_suffix()
+_ENCODED_SUFFIX = quote_plus(_SCOPE_SUFFIX)
+_SEARCH_URL = httpx.URL(f"{GITHUB_API_URL}/search/code")
 
-    q = _build_q(query)
-    if not q:
-        return []  # not scoped → do nothing
 
-    headers = {
-        "Authorization": f"token {token}",
-        "Accept": "application/vnd.github.v3+json",
-    }
-    params = {"q": q, "per_page": max(1, min(50, limit * 2))}
-
-    async with httpx.AsyncClient(timeout=10.0) as client:
-        try:
-            resp = await asyncio.wait_for(
-                client.get(f"{GITHUB_API_URL}/search/code", headers=headers, params=params),
-                timeout=1.5,
-            )
-        except asyncio.TimeoutError:
-            return []
-    if resp.status_code != 200:
-        return []
+def _build_q(user_q: str) -> str:
+    """
+    Scope the search to your org or repos to avoid public GitHub noise.
+    Returns the URL-encoded `q` value; only the user part is encoded per call.
+    """
+    if not _SCOPE_SUFFIX:
+        # Nothing to scope → skip adapter
+        return ""
+    uq = (user_q or "").strip()
+    return f"{quote_plus(uq)}+{_ENCODED_SUFFIX}" if uq else _ENCODED_SUFFIX
+
 
-    items = resp.json().get("items", [])
-    out: List[NormalizedCandidate] = []
+def _iter_items(items: List[dict]) -> Iterator[NormalizedCandidate]:
     for it in items:
         repo = it.get("repository") or {}
         repo_full = repo.get("full_name", "")
         path = it.get("path", "")
         html_url = it.get("html_url", "")
 
+        url = html_url or (f"https://github.com/{repo_full}/blob/main/{path}" if repo_full and path else "")
+        if not url:
+            continue
+
         title = f"{repo_full}/{path}" if repo_full and path else (html_url or path or "doc")
         snippet = title[:240]
 
-        out.append(NormalizedCandidate(
+        # Trusted API shape: model_construct skips per-row Pydantic validation
+        yield NormalizedCandidate.model_construct(
             source="github",
             doc_id=f"{repo_full}:{path}",
-            url=html_url or (f"https://github.com/{repo_full}/blob/main/{path}" if repo_full and path else ""),
+            url=url,
             title=title,
             snippet=snippet,
             last_modified=_iso(repo.get("updated_at")),
@@ -109,7 +115,124 @@ async def search_corpus(
                 "path_hint": "/docs" if "/docs/" in f"/{path}" else "",
                 "approved_pr": 0,  # optional enrichment later
             },
-        ))
-        if len(out) >= limit:
-            break
+        )
+
+
+def _cache_key(user_id: int | None, query: str, limit: int) -> str:
+    # Per-user so cached results never leak across accounts
+    return make_key(user_id, query, limit)
+
+
+def _copies(cands: List[NormalizedCandidate]) -> List[NormalizedCandidate]:
+    """
+    Per-caller copies: policy.guard redacts snippets in place, which must not reach the
+    shared cache/ETag entries or other requests joined on the same in-flight search.
+    """
+    return [c.model_copy() if isinstance(c, NormalizedCandidate) else c for c in cands]
+
+
+def _drop_inflight(key: str, task: asyncio.Task) -> None:
+    if _INFLIGHT.get(key) is task:
+        del _INFLIGHT[key]
+    # Mark any exception as retrieved even if every waiter already gave up
+    if not task.cancelled():
+        task.exception()
+
+
+async def search_corpus(
+    user_id: int | None,
+    query: str,
+    limit: int,
+    db: AsyncSession,
+    *,
+    http: httpx.AsyncClient,
+) -> List[NormalizedCandidate]:
+    if not _SCOPE_SUFFIX:
+        return []  # not scoped → skip cache, token lookup and request
+
+    key = _cache_key(user_id, query, limit)
+    cached = github_cache.get(key)
+    if cached is not None:
+        log.debug("github_cache_hit key=%s", key)
+        return _copies(cached)
+
+    task = _INFLIGHT.get(key)
+    if task is None:
+        # Resolve the token on this request's session; the shared task must not hold `db`,
+        # which belongs to (and is closed with) whichever request started it
+        token = await _get_token(db, user_id)
+        if not token:
+            return []
+        task = _INFLIGHT.get(key)  # another caller may have started it while we awaited
+    if task is None:
+        task = asyncio.ensure_future(_fetch(key, user_id, query, limit, token, http))
+        _INFLIGHT[key] = task
+        task.add_done_callback(lambda t, _key=key: _drop_inflight(_key, t))
+    else:
+        log.debug("github_inflight_join key=%s", key)
+    # Shield so one caller timing out doesn't cancel the search for the others
+    return _copies(await asyncio.shield(task))
+
+
+def _retry_after_s(resp: httpx.Response) -> float:
+    try:
+        return max(1.0, float(resp.headers.get("Retry-After", "")))
+    except ValueError:
+        return 60.0
+
+
+async def _fetch(
+    key: str,
+    user_id: int | None,
+    query: str,
+    limit: int,
+    token: str,
+    http: httpx.AsyncClient,
+) -> List[NormalizedCandidate]:
+    global _RATE_LIMIT_UNTIL
+    if time.monotonic() < _RATE_LIMIT_UNTIL:
+        return [{"rate_limited": 1}]  # sentinel understood by gather_candidates
+
+    q = _build_q(query)
+    if not q:
+        return []  # not scoped → do nothing
+
+    headers = {
+        "Authorization": f"token {token}",
+        "Accept": "application/vnd.github.v3+json",
+    }
+    validator = _ETAGS.get(key)
+    if validator:
+        headers["If-None-Match"] = validator[0]
+    url = _SEARCH_URL.copy_with(query=f"q={q}&per_page={max(1, min(50, limit * 2))}".encode())
+
+    body = b""
+    try:
+        async with asyncio.timeout(1.5):
+            async with http.stream("GET", url, headers=headers) as resp:
+                # Only a 200 has a body we use; 304/4xx are released unread
+                if resp.status_code == 200:
+                    body = await resp.aread()
+    except TimeoutError:
+        return []
+    if resp.status_code == 401:
+        invalidate_token("github", user_id)
+        return []
+    if resp.status_code == 304 and validator:
+        # Unchanged; 304s don't count against the GitHub rate limit
+        github_cache.set(key, validator[1])
+        return validator[1]
+    if resp.status_code == 429 or (resp.status_code == 403 and "Retry-After" in resp.headers):
+        _RATE_LIMIT_UNTIL = time.monotonic() + _retry_after_s(resp)
+        log.warning("github_rate_limited retry_after_s=%.0f", _RATE_LIMIT_UNTIL - time.monotonic())
+        return [{"rate_limited": 1}]
+    if resp.status_code != 200:
+        return []
+
+    items = loads(body).get("items", [])
+    out = list(islice(_iter_items(items), limit))
+    github_cache.set(key, out)
+    etag = resp.headers.get("ETag")
+    if etag:
+        _ETAGS.set(key, (etag, out))
     return out
@@ -1,50 +1,119 @@
 # app/connectorhub/slack.py
 from __future__ import annotations
-from typing import List, Optional
+from typing import Dict, List, Optional, Tuple
 from datetime import datetime, timezone
-import os, httpx, re, logging
+import os, asyncio, contextvars, httpx, random, re, logging, time
 
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
 from app.models import Connection
-from app.deps import get_crypto
+from app.services.crypto import decrypt_str
 from app.schemas import NormalizedCandidate
+from app.services.cache import slack_permalink_cache
+from app.services.deadline import remaining_s
+from app.services.jsonutil import loads
+from app.services.logging import get_logger, log_kv
+from app.services.token_cache import get_cached_token, set_cached_token
+from app.services.throttle import AIMDLimiter, SlidingWindowThrottle
 
 SLACK_CHANNELS = os.getenv("SLACK_CHANNELS", "")   # e.g., "C123,C456"
 SLACK_FAST = os.getenv("SLACK_FAST", "0") == "1"   # pins-only fast path
 
+log = logging.getLogger(__name__)
+LOG = get_logger("backend")  # structured key=value events
+
+_SLACK_TIMEOUT = httpx.Timeout(15.0, connect=5.0)
+_MAX_RETRIES = 3  # after the first attempt; each wait is capped at 30s
+
+# Per-method requests/minute, roughly Slack's Web API tiers (Tier 2 default)
+_THROTTLE = SlidingWindowThrottle(
+    {
+        "conversations.history": 50,
+        "chat.getPermalink": 100,
+        # Tier 2 ("20+"): tolerates bursts; pins.list runs once per scanned channel per query
+        "pins.list": 50,
+        "conversations.list": 20,
+    },
+    default=20,
+)
+
+# Concurrent per-channel scans; adapts to Slack's observed latency and 429/5xx responses
+_CHANNEL_LIMIT = AIMDLimiter(initial=8, c_min=1, c_max=32, alpha=0.5, beta=0.5, target_s=0.8)
+
+# One dict per search_corpus call; channel-scan tasks share it through the copied context,
+# so any throttled/429 call can mark the search as rate limited for connectorhub
+_RATE_LIMITED: contextvars.ContextVar[dict | None] = contextvars.ContextVar("slack_rate_limited", default=None)
+
+def _mark_rate_limited() -> None:
+    flag = _RATE_LIMITED.get()
+    if flag is not None:
+        flag["hit"] = True
+
 _HEADING_RE = re.compile(r"^[\*\_\~\s]*([^:\n]{1,200}):\s*$")
+_LINE_RE = re.compile(r"[^\r\n]+")
 
 async def _get_token(db: AsyncSession) -> Optional[str]:
-    row = (await db.execute(
-        select(Connection).where(Connection.provider == "slack")
+    cached = get_cached_token("slack")
+    if cached:
+        return cached
+    token_enc = (await db.execute(
+        select(Connection.access_token_enc).where(Connection.provider == "slack").limit(1)
     )).scalar_one_or_none()
-    if not row or not row.access_token_enc:
+    if not token_enc:
         return None
     try:
-        return get_crypto().decrypt(row.access_token_enc.encode()).decode()
+        token = decrypt_str(token_enc)
     except Exception:
-        logging.exception("slack_token_decrypt_failed")
+        log.exception("slack_token_decrypt_failed")
         return None
+    set_cached_token("slack", None, token)
+    return token
 
 def _dt_from_ts(ts: str) -> datetime:
     return datetime.fromtimestamp(float(ts), tz=timezone.utc)
 
 async def _slack_get(client: httpx.AsyncClient, token: str, path: str, params: dict | None = None) -> dict:
-    r = await client.get(
-        f"https://slack.com/api/{path}",
-        params=params or {},
-        headers={"Authorization": f"Bearer {token}"},
-        timeout=10.0,
-    )
-    try:
-        data = r.json()
-    except Exception:
-        return {"ok": False, "error": f"http_{r.status_code}"}
+    for attempt in range(_MAX_RETRIES + 1):
+        if not await _THROTTLE.wait(path):
+            # No free slot before the provider budget runs out; report it instead of timing out
+            log_kv(LOG, logging.WARNING, "slack.throttled", method=path, attempt=attempt + 1)
+            _mark_rate_limited()
+            return {"ok": False, "error": "ratelimited"}
+        t0 = time.perf_counter()
+        r = await client.get(
+            f"https://slack.com/api/{path}",
+            params=params or {},
+            headers={"Authorization": f"Bearer {token}"},
+            timeout=_SLACK_TIMEOUT,
+        )
+        try:
+            data = loads(r.content)
+        except Exception:
+            data = None
+        limited = r.status_code == 429 or (data is not None and data.get("error") == "ratelimited")
+        await _CHANNEL_LIMIT.record(time.perf_counter() - t0, ok=not limited and r.status_code < 500)
+        if not limited:
+            return data if data is not None else {"ok": False, "error": f"http_{r.status_code}"}
+        if attempt == _MAX_RETRIES:
+            break
+        # Prefer Slack's Retry-After (header, then body); otherwise exponential backoff, plus jitter
+        hint = r.headers.get("Retry-After") or (data or {}).get("retry_after")
+        try:
+            base = float(hint) if hint is not None else float(2 ** attempt)
+        except ValueError:
+            base = float(2 ** attempt)
+        delay = min(30.0, base + random.random() * 0.5)
+        left = remaining_s()
+        if left is not None and delay >= left:
+            # The wait alone would outlast the provider budget; give up instead of burning it
+            log_kv(LOG, logging.INFO, "slack.retry_skipped", method=path, delay_s=f"{delay:.2f}", left_s=f"{left:.2f}")
+            break
+        log_kv(LOG, logging.INFO, "slack.retry", method=path, attempt=attempt + 1, delay_s=f"{delay:.2f}")
+        await asyncio.sleep(delay)
     # Treat rate limit explicitly so hub can tag it if needed (we just return empty here)
-    if data.get("error") in {"ratelimited"}:
-        return {"ok": False, "error": "ratelimited"}
-    return data
+    log_kv(LOG, logging.WARNING, "slack.ratelimited", method=path, attempts=attempt + 1)
+    _mark_rate_limited()
+    return {"ok": False, "error": "ratelimited"}
 
 def _preview(text: str) -> str:
     """
@@ -52,128 +121,198 @@ def _preview(text: str) -> str:
     - take the first non-empty line
     - if it ends with a colon, append the next non-empty line
     - soft-trim to ~240 chars
+    Lines are scanned lazily; scanning stops once the needed lines are found.
     """
     if not text:
         return ""
-    # normalize newlines and strip
-    clean = text.replace("\r\n", "\n").replace("\r", "\n").strip()
-    # all non-empty logical lines (no paragraph restriction)
-    lines = [ln.strip() for ln in clean.split("\n") if ln.strip()]
-    if not lines:
+    first = second = None
+    for m in _LINE_RE.finditer(text):
+        ln = m.group().strip()
+        if not ln:
+            continue
+        if first is None:
+            first = ln
+            # only a heading (ends with ':') needs the next line
+            if not first.endswith(":"):
+                break
+        else:
+            second = ln
+            break
+    if not first:
         return ""
+    if second:
+        return f"{first} {second}"[:240].rstrip()
+    return first[:240].rstrip()
 
-    first = lines[0]
-    # include second line if the first looks like a heading (ends with ':')
-    if first.endswith(":") and len(lines) > 1:
-        combined = f"{first} {lines[1]}"
-        return (combined[:240]).rstrip()
-
-    # otherwise just the first line
-    return (first[:240]).rstrip()
-
+async def _permalinks(client: httpx.AsyncClient, token: str, pending: List[Tuple[str, str]]) -> Dict[Tuple[str, str], str]:
+    """Resolve (cid, ts) → permalink: cache hits first, misses fetched in one concurrent fan-out."""
+    links: Dict[Tuple[str, str], str] = {}
+    misses: List[Tuple[str, str]] = []
+    for cid, ts in pending:
+        pl = slack_permalink_cache.get(f"{cid}:{ts}")
+        if pl:
+            links[(cid, ts)] = pl
+        else:
+            misses.append((cid, ts))
+    if misses:
+        results = await asyncio.gather(*[
+            _slack_get(client, token, "chat.getPermalink", {"channel": cid, "message_ts": ts})
+            for cid, ts in misses
+        ])
+        for (cid, ts), res in zip(misses, results):
+            pl = res.get("permalink") if res.get("ok") else None
+            if pl:
+                links[(cid, ts)] = pl
+                slack_permalink_cache.set(f"{cid}:{ts}", pl)
+    return links
 
 async def _pins_fast(client: httpx.AsyncClient, token: str, cid: str, query: str, limit: int) -> List[NormalizedCandidate]:
     pins = await _slack_get(client, token, "pins.list", {"channel": cid})
     if not pins.get("ok"):
         return []
-    out: List[NormalizedCandidate] = []
-    matched: List[NormalizedCandidate] = []
-    # cache permalinks per ts to avoid double calls if you like (kept simple here)
+    out: List[Tuple[str, str]] = []
+    matched: List[Tuple[str, str]] = []
+    q_cf = query.casefold()
     for it in pins.get("items", []):
         msg = it.get("message") or {}
         text = msg.get("text") or ""
         ts = msg.get("ts")
         if not text or not ts:
             continue
-        pl = await _slack_get(client, token, "chat.getPermalink", {"channel": cid, "message_ts": ts})
-        if not pl.get("ok"):
-            continue
-        cand = NormalizedCandidate(
+        if q_cf and q_cf in text.casefold():
+            matched.append((ts, text))
+            if len(matched) >= limit:
+                break
+        else:
+            out.append((ts, text))
+    # Permalinks only for the pins we actually return
+    chosen = (matched or out)[:limit]
+    links = await _permalinks(client, token, [(cid, ts) for ts, _ in chosen])
+    # Trusted API shape: model_construct skips per-row Pydantic validation
+    return [
+        NormalizedCandidate.model_construct(
             source="slack",
             doc_id=f"{cid}:{ts}",
-            url=pl.get("permalink",""),
+            url=links[(cid, ts)],
             title="Slack thread",
             snippet=_preview(text),
             last_modified=_dt_from_ts(ts),
             owner="slack",
             signals={"pinned": True, "accepted": ("✅" in text)},
         )
-        if query and query.lower() in text.lower():
-            matched.append(cand)
-        else:
-            out.append(cand)
-        if len(matched) >= limit:
-            return matched[:limit]
-    return (matched or out)[:limit]
+        for ts, text in chosen
+        if (cid, ts) in links
+    ]
+
+async def _scan_channel(client: httpx.AsyncClient, token: str, cid: str, query: str, limit: int) -> List[NormalizedCandidate]:
+    """pins.list → conversations.history → filter pinned/✅ + query → permalinks, for one channel."""
+    async with _CHANNEL_LIMIT:
+        pins = await _slack_get(client, token, "pins.list", {"channel": cid})
+        pinned_ts = set()
+        if pins.get("ok"):
+            for it in pins.get("items", []):
+                msg = it.get("message") or {}
+                if "ts" in msg:
+                    pinned_ts.add(msg["ts"])
+
+        hist = await _slack_get(client, token, "conversations.history", {"channel": cid, "limit": 200})
+        if not hist.get("ok"):
+            return []
+        pending: List[Tuple[str, str, bool, bool]] = []
+        q_cf = query.casefold()
+        for m in hist.get("messages", []):
+            ts = m.get("ts")
+            if not ts:
+                continue
+            # Most messages are neither pinned nor ✅; reject them before any query matching
+            pinned = ts in pinned_ts
+            text = m.get("text") or ""
+            accepted = "✅" in text
+            if not text or not (accepted or pinned):
+                continue
+            if q_cf and q_cf not in text.casefold():
+                continue
+            pending.append((ts, text, pinned, accepted))
+            if len(pending) >= limit:
+                break
 
-async def search_corpus(user_id: int | None, query: str, limit: int, db: AsyncSession) -> List[NormalizedCandidate]:
+        # Resolve permalinks after filtering, concurrently and cache-first
+        links = await _permalinks(client, token, [(cid, ts) for ts, *_ in pending])
+        # Trusted API shape: model_construct skips per-row Pydantic validation
+        return [
+            NormalizedCandidate.model_construct(
+                source="slack",
+                doc_id=f"{cid}:{ts}",
+                url=links[(cid, ts)],
+                title="Slack thread",
+                snippet=_preview(text),
+                last_modified=_dt_from_ts(ts),
+                owner="slack",
+                signals={"pinned": pinned, "accepted": accepted},
+            )
+            for ts, text, pinned, accepted in pending
+            if (cid, ts) in links
+        ]
+
+async def search_corpus(
+    user_id: int | None,
+    query: str,
+    limit: int,
+    db: AsyncSession,
+    *,
+    http: httpx.AsyncClient,
+) -> List[NormalizedCandidate]:
     token = await _get_token(db)
     if not token:
         return []
+    limited = {"hit": False}
+    _RATE_LIMITED.set(limited)
 
     channels = [c.strip() for c in SLACK_CHANNELS.split(",") if c.strip()]
-    out: List[NormalizedCandidate] = []
-    matched: List[NormalizedCandidate] = []
-
-    async with httpx.AsyncClient() as client:
-        # FAST mode (pins on single channel) with auto-fallback
-        if SLACK_FAST:
-            if not channels or len(channels) != 1:
-                logging.info("slack_fast_requires_single_channel")
-            else:
-                cands = await _pins_fast(client, token, channels[0], query, limit)
-                if cands:
-                    return cands
-                # no pins or no match → fall back to normal mode below
-                logging.info("slack_fast_empty_falling_back")
-
-        # NORMAL mode: discover channels if not provided, scan recent history + pins
-        if not channels:
-            res = await _slack_get(client, token, "conversations.list",
-                                   {"limit": 60, "types": "public_channel,private_channel"})
-            if not res.get("ok"):
-                logging.info("slack_conversations_list_failed error=%s", res.get("error"))
-                return []
-            channels = [ch["id"] for ch in res.get("channels", [])]
-
-        for cid in channels:
-            pins = await _slack_get(client, token, "pins.list", {"channel": cid})
-            pinned_ts = set()
-            if pins.get("ok"):
-                for it in pins.get("items", []):
-                    msg = it.get("message") or {}
-                    if "ts" in msg:
-                        pinned_ts.add(msg["ts"])
-
-            hist = await _slack_get(client, token, "conversations.history", {"channel": cid, "limit": 120})
-            if not hist.get("ok"):
+
+    # FAST mode (pins on single channel) with auto-fallback
+    if SLACK_FAST:
+        if not channels or len(channels) != 1:
+            log.debug("slack_fast_requires_single_channel")
+        else:
+            cands = await _pins_fast(http, token, channels[0], query, limit)
+            if cands:
+                return cands
+            # no pins or no match → fall back to normal mode below
+            log.debug("slack_fast_empty_falling_back")
+
+    # NORMAL mode: discover channels if not provided, scan recent history + pins
+    if not channels:
+        res = await _slack_get(http, token, "conversations.list",
+                               {"limit": 60, "types": "public_channel,private_channel"})
+        if not res.get("ok"):
+            log.info("slack_conversations_list_failed error=%s", res.get("error"))
+            return [{"rate_limited": 1}] if limited["hit"] else []
+        channels = [ch["id"] for ch in res.get("channels", [])]
+
+    # Scan channels concurrently; stop waiting once `limit` matches are in hand
+    tasks = [asyncio.create_task(_scan_channel(http, token, cid, query, limit)) for cid in channels]
+    found = 0
+    try:
+        for fut in asyncio.as_completed(tasks):
+            try:
+                found += len(await fut)
+            except Exception:
+                log.exception("slack_channel_scan_failed")
                 continue
-            for m in hist.get("messages", []):
-                text = m.get("text") or ""
-                ts = m.get("ts")
-                if not text or not ts:
-                    continue
-                accepted = "✅" in text
-                pinned = ts in pinned_ts
-                if not (accepted or pinned):
-                    continue
-                if query and query.lower() not in text.lower():
-                    continue
-                pl = await _slack_get(client, token, "chat.getPermalink", {"channel": cid, "message_ts": ts})
-                if not pl.get("ok"):
-                    continue
-                cand = NormalizedCandidate(
-                    source="slack",
-                    doc_id=f"{cid}:{ts}",
-                    url=pl.get("permalink",""),
-                    title="Slack thread",
-                    snippet=_preview(text),
-                    last_modified=_dt_from_ts(ts),
-                    owner="slack",
-                    signals={"pinned": pinned, "accepted": accepted},
-                )
-                matched.append(cand)
-                if len(matched) >= limit:
-                    return matched[:limit]
-
-        return matched[:limit] if matched else out[:limit]
+            if found >= limit:
+                break
+    finally:
+        for t in tasks:
+            t.cancel()  # no-op for finished scans
+
+    # Flatten in configured channel order so results stay deterministic
+    matched = [
+        c
+        for t in tasks
+        if t.done() and not t.cancelled() and t.exception() is None
+        for c in t.result()
+    ]
+    if not matched and limited["hit"]:
+        return [{"rate_limited": 1}]  # sentinel understood by gather_candidates
+    return matched[:limit]
@@ -4,15 +4,18 @@ import os
 from pathlib import Path
 from typing import AsyncGenerator
 
+import httpx
+from fastapi import Request
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine, async_sessionmaker
 from sqlalchemy.orm import DeclarativeBase
 
 # ---- Load .env early (once) ----
+# backend/.env relative to this file; deployments that inject env skip dotenv entirely
+env_path = Path(__file__).resolve().parents[1] / ".env"
 try:
-    from dotenv import load_dotenv
-    # backend/.env relative to this file
-    env_path = Path(__file__).resolve().parents[1] / ".env"
-    load_dotenv(dotenv_path=env_path, override=False)
+    if env_path.exists():
+        from dotenv import load_dotenv
+        load_dotenv(dotenv_path=env_path, override=False)
 except Exception:
     # If python-dotenv isn't installed, env may be provided by the shell; that's OK.
     pass
@@ -25,8 +28,18 @@ if not DATABASE_URL:
 class Base(DeclarativeBase):
     pass
 
-engine = create_async_engine(DATABASE_URL, echo=False, future=True)
-SessionLocal = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+# Pool sizing is env-tunable; SQLite's async driver doesn't take QueuePool options
+_POOL_KW = {} if DATABASE_URL.startswith("sqlite") else {
+    "pool_size": int(os.getenv("DB_POOL_SIZE", "20")),
+    "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "40")),
+    "pool_timeout": float(os.getenv("DB_POOL_TIMEOUT", "30")),
+    "pool_pre_ping": True,
+    "pool_recycle": 1800,
+}
+
+engine = create_async_engine(DATABASE_URL, echo=False, future=True, **_POOL_KW)
+# No autoflush: handlers write via explicit statements or add()+commit, never read-after-add
+SessionLocal = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False, autoflush=False)
 
 async def get_db() -> AsyncGenerator[AsyncSession, None]:
     async with SessionLocal() as session:
@@ -38,3 +51,7 @@ from app.services.crypto import get_fernet as _get_fernet_singleton  # noqa: E40
 def get_crypto():
     """Return process-wide Fernet/MultiFernet instance (lazy)."""
     return _get_fernet_singleton()
+
+def get_http(request: Request) -> httpx.AsyncClient:
+    """Return the app-wide pooled HTTP client created in the lifespan."""
+    return request.app.state.http
@@ -1,11 +1,12 @@
-from typing import List, Tuple, Dict
+from typing import List, Optional, Tuple, Dict
+from collections import Counter
 from datetime import datetime, timezone
 from app.schemas import NormalizedCandidate
 import math
 
-def _freshness_score(dt: datetime) -> float:
-    # newer → closer to 1.0
-    age_days = max(0.0, (datetime.now(timezone.utc) - dt).total_seconds()/86400.0)
+def _freshness_score(dt: datetime, now: datetime) -> float:
+    # newer → closer to 1.0; `now` is taken once per rank() call
+    age_days = max(0.0, (now - dt).total_seconds()/86400.0)
     # simple sigmoid-ish
     return 1.0 / (1.0 + (age_days / 7.0))
 
@@ -30,32 +31,34 @@ def _specificity_score(c: NormalizedCandidate, query: str) -> float:
     return 0.15*title_hit + 0.05*body_hit
 
 
-def score_candidate(c: NormalizedCandidate, query: str) -> float:
-    fresh = _freshness_score(c.last_modified)
-    auth = _authority_score(c)
-    spec = _specificity_score(c, query)
+def _combine(fresh: float, auth: float, spec: float) -> float:
     # Rebalanced weights: fresh 0.5, auth 0.4, spec 0.2
     return 0.5*fresh + 0.4*auth + 0.2*spec
 
+def score_candidate(c: NormalizedCandidate, query: str, now: Optional[datetime] = None) -> float:
+    fresh = _freshness_score(c.last_modified, now or datetime.now(timezone.utc))
+    auth = _authority_score(c)
+    spec = _specificity_score(c, query)
+    return _combine(fresh, auth, spec)
+
 def rank(candidates: List[NormalizedCandidate], query: str) -> Tuple[NormalizedCandidate, Dict[str, float], Dict[str, List[str]]]:
     # returns: (chosen, scores_by_doc_id, reasons_by_doc_id)
     scores, reasons = {}, {}
+    now = datetime.now(timezone.utc)
+    # consensus bump (if same URL among sources); counted up front so scoring and argmax share one pass
+    url_counts = Counter(c.url for c in candidates)
+    chosen, best = None, float("-inf")
     for c in candidates:
-        s = score_candidate(c, query)
+        # score each component once; reuse it for both the score and the trace reasons
+        fresh = _freshness_score(c.last_modified, now)
+        auth = _authority_score(c)
+        spec = _specificity_score(c, query)
+        s = _combine(fresh, auth, spec)
+        reasons[c.doc_id] = [f"fresh={fresh:.2f}", f"auth={auth:.2f}", f"spec={spec:.2f}"]
+        if url_counts[c.url] >= 2:
+            s += 0.05
+            reasons[c.doc_id].append("consensus=+0.05")
         scores[c.doc_id] = s
-        reasons[c.doc_id] = []
-        # minimal reasons for trace
-        reasons[c.doc_id].append(f"fresh={_freshness_score(c.last_modified):.2f}")
-        reasons[c.doc_id].append(f"auth={_authority_score(c):.2f}")
-        reasons[c.doc_id].append(f"spec={_specificity_score(c, query):.2f}")
-    # consensus bump (if same URL among sources)
-    by_url = {}
-    for c in candidates:
-        by_url.setdefault(c.url, []).append(c.doc_id)
-    for url, ids in by_url.items():
-        if len(ids) >= 2:
-            for did in ids:
-                scores[did] += 0.05
-                reasons[did].append("consensus=+0.05")
-    chosen = max(candidates, key=lambda c: scores[c.doc_id])
-    return chosen, scores, reasons
\ No newline at end of file
+        if s > best:
+            chosen, best = c, s
+    return chosen, scores, reasons
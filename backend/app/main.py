@@ -1,20 +1,24 @@
 # app/main.py
 from __future__ import annotations
 
+import asyncio
 import logging
 import time
-import re
 from contextlib import asynccontextmanager
+from functools import partial
 from datetime import datetime, timezone
-from typing import Dict, List
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Tuple
 
-from fastapi import FastAPI, Request, Response, HTTPException, Depends
+import httpx
+from fastapi import FastAPI, Response, HTTPException, Depends, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import JSONResponse, ORJSONResponse
 from pydantic import BaseModel, Field
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.deps import engine, Base, get_db
+from app.deps import engine, Base, get_db, get_http
 from app.models import QueryLog
 from app.schemas import AskResponse, Citation, NormalizedCandidate
 from app.fusion.rank import rank as fusion_rank
@@ -25,9 +29,20 @@ from app.services.logging import (
     bind_trace_id,
     get_trace_id,
     log_kv,
+    stop_log_listener,
 )
 from app.routers.connections import router as connections_router
-from app.connectorhub import gather_candidates
+from app.connectorhub import gather_candidates, new_http_client
+from app.services.jsonutil import HAS_ORJSON
+from app.services.querylog_queue import (
+    enqueue_query_log,
+    flush_pending,
+    open_query_log_queue,
+    persist_query_logs,
+    run_flusher,
+)
+from app.services.trace_store import save_trace, save_trace_lazy, load_trace
+from app.services.redis_client import aclose_redis
 
 
 # ---------- Lifespan (startup/shutdown) ----------
@@ -36,11 +51,28 @@ async def lifespan(app: FastAPI):
     # Create tables (hackathon-simple; Alembic optional)
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+    # One pooled HTTP client shared by all provider adapters
+    app.state.http = new_http_client()
+    # Batches QueryLog inserts off the request path; queue is bound to this lifespan's loop
+    open_query_log_queue()
+    flusher = asyncio.create_task(run_flusher())
     yield
-    # No shutdown hooks needed for now
+    flusher.cancel()
+    try:
+        await flusher
+    except asyncio.CancelledError:
+        pass
+    await flush_pending()
+    await app.state.http.aclose()
+    await aclose_redis()
+    # Last: flush the background log writer so shutdown lines are not lost
+    stop_log_listener()
+
 
+# orjson-backed responses when the optional extension is installed
+DefaultResponse = ORJSONResponse if HAS_ORJSON else JSONResponse
 
-app = FastAPI(title="OneSource Backend (Phase 4)", lifespan=lifespan)
+app = FastAPI(title="OneSource Backend (Phase 4)", lifespan=lifespan, default_response_class=DefaultResponse)
 LOG = get_logger("backend")
 app.include_router(connections_router)
 
@@ -53,37 +85,50 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# ---------- Per-request trace middleware ----------
-@app.middleware("http")
-async def trace_middleware(request: Request, call_next):
-    tid = new_trace_id()
-    bind_trace_id(tid)
+# ---------- Compression (trace payloads are several KB) ----------
+app.add_middleware(GZipMiddleware, minimum_size=1024)
 
-    start = time.perf_counter()
-    response: Response | None = None
-    try:
-        response = await call_next(request)
-    finally:
-        duration_ms = int((time.perf_counter() - start) * 1000)
-        log_kv(
-            LOG,
-            logging.INFO,
-            "request.complete",
-            method=request.method,
-            path=request.url.path,
-            status=getattr(response, "status_code", 0) if response else 0,
-            duration_ms=duration_ms,
-        )
-
-    if response:
-        response.headers["X-Trace-Id"] = get_trace_id()
-        return response
-
-    return JSONResponse(
-        status_code=500,
-        content={"detail": "Internal server error before response generation."},
-        headers={"X-Trace-Id": get_trace_id()},
-    )
+# ---------- Per-request trace middleware ----------
+class TraceMiddleware:
+    """Pure ASGI: bind a trace id, stamp X-Trace-Id on the response, log one line per request."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        tid = new_trace_id()
+        bind_trace_id(tid)
+        tid_header = (b"x-trace-id", tid.encode())
+        status = 0
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message["headers"] = [*message.get("headers", ()), tid_header]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            duration_ms = int((time.perf_counter() - start) * 1000)
+            log_kv(
+                LOG,
+                logging.INFO,
+                "request.complete",
+                method=scope["method"],
+                path=scope["path"],
+                status=status,
+                duration_ms=duration_ms,
+            )
+
+
+app.add_middleware(TraceMiddleware)
 
 
 # ---------- Health ----------
@@ -92,10 +137,6 @@ async def healthz():
     return {"ok": True}
 
 
-# ---------- In-memory trace store ----------
-TRACE_STORE: Dict[str, dict] = {}
-
-
 # ---------- Request schema ----------
 class AskRequest(BaseModel):
     query: str = Field(..., min_length=1, max_length=256)
@@ -103,23 +144,104 @@ class AskRequest(BaseModel):
 
 def _summarize_answer(snippet: str) -> str:
     """Prefer first paragraph, tidy heading lines, soft-trim ~240 chars."""
-    para = snippet.strip().split("\n\n", 1)[0].strip()
-    lines = [ln.strip() for ln in para.splitlines() if ln.strip()]
-    if lines and lines[0].endswith(":") and len(lines) > 1:
-        text = f"{lines[0]} {lines[1]}"
-    else:
-        text = lines[0] if lines else snippet.strip()
+    body = snippet.strip()
+    end = body.find("\n\n")
+    para = (body if end < 0 else body[:end]).strip()
+    # first line via find(); only a heading (ends with ':') needs the next non-empty line
+    nl = para.find("\n")
+    first = (para if nl < 0 else para[:nl]).strip()
+    text = first or body
+    if first.endswith(":"):
+        while nl >= 0:
+            start = nl + 1
+            nl = para.find("\n", start)
+            nxt = (para[start:] if nl < 0 else para[start:nl]).strip()
+            if nxt:
+                text = f"{first} {nxt}"
+                break
     if len(text) > 240:
-        text = re.sub(r"\s+\S*$", "", text[:240]) + "…"
+        # cut back to the last word boundary inside the limit: drop the trailing partial word
+        # and the whitespace run (any str.isspace char, tabs/NBSP included) before it
+        head = text[:240]
+        cut = len(head)
+        while cut and not head[cut - 1].isspace():
+            cut -= 1
+        if cut:
+            while cut and head[cut - 1].isspace():
+                cut -= 1
+            head = head[:cut]
+        text = head + "…"
     return text
 
 
+def _distinct_urls(ranked: Iterable[NormalizedCandidate]) -> Iterator[NormalizedCandidate]:
+    """Yield the first (highest-ranked) candidate per URL, lazily."""
+    seen = set()
+    for c in ranked:
+        if c.url not in seen:
+            seen.add(c.url)
+            yield c
+
+
+_PROVIDERS = ("slack", "drive", "github")
+
+
+def _build_provider_telemetry(provider_meta: Dict[str, dict]) -> Tuple[Dict[str, int], Dict[str, dict]]:
+    """One pass over provider_meta → (timings_ms, provider_flags) for the trace."""
+    timings: Dict[str, int] = {}
+    flags: Dict[str, dict] = {}
+    for p in _PROVIDERS:
+        d = provider_meta.get(p) or {}
+        timings[p] = d.get("ms", 0)
+        flags[p] = {
+            "timeout": d.get("timeout", False),
+            "error": d.get("error"),
+            "rate_limited": d.get("rate_limited", 0),
+        }
+    return timings, flags
+
+
+def _materialize_trace(
+    trace_id: str,
+    query: str,
+    provider_meta: Dict[str, dict],
+    ranked: List[NormalizedCandidate],
+    scores_by_id: Dict[str, float],
+    reasons_by_id: Dict[str, List[str]],
+    chosen: NormalizedCandidate,
+    confidence: float,
+    redactions: List[str],
+    conflict: bool,
+) -> dict:
+    """Build the /trace payload for a successful /ask from its raw inputs (`ranked` is score-desc)."""
+    timings, flags = _build_provider_telemetry(provider_meta)
+    return {
+        "trace_id": trace_id,
+        "query": query,
+        "timings_ms": {**timings, "fusion": 2, "policy": 1},
+        "provider_flags": flags,
+        "candidates": [
+            # scores are already floats and urls plain str, so no coercion is needed
+            {"source": c.source, "url": c.url, "score": scores_by_id[c.doc_id], "reasons": reasons_by_id[c.doc_id]}
+            for c in ranked
+        ],
+        "chosen": {
+            "url": chosen.url,
+            "score": confidence,
+            "explanations": reasons_by_id[chosen.doc_id],
+        },
+        "policy": {"redactions": redactions, "conflict": conflict},
+    }
+
+
 # ---------- POST /ask (ConnectorHub → Fusion → Policy) ----------
 @app.post("/ask", response_model=AskResponse)
 async def ask_endpoint(
     payload: AskRequest,
     response: Response,
+    background: BackgroundTasks,
     db: AsyncSession = Depends(get_db),
+    http: httpx.AsyncClient = Depends(get_http),
 ):
     # 1) Validate
     query = payload.query.strip()
@@ -136,71 +258,44 @@ async def ask_endpoint(
     candidates: List[NormalizedCandidate]
     provider_meta: Dict[str, dict]
     candidates, provider_meta = await gather_candidates(
-        db=db, user_id=None, query=query, limit=5
+        db=db, user_id=None, query=query, limit=5, http=http
     )
 
     # If zero providers produced candidates, record a trace and raise 503 (with trace_id)
     if not candidates:
-        TRACE_STORE[trace_id] = {
+        timings, flags = _build_provider_telemetry(provider_meta)
+        await save_trace(trace_id, {
             "trace_id": trace_id,
             "query": query,
-            "timings_ms": {
-                "slack": provider_meta.get("slack", {}).get("ms", 0),
-                "drive": provider_meta.get("drive", {}).get("ms", 0),
-                "github": provider_meta.get("github", {}).get("ms", 0),
-                "fusion": 0,
-                "policy": 0,
-            },
-            "provider_flags": {
-                "slack": {
-                    "timeout": provider_meta.get("slack", {}).get("timeout", False),
-                    "error": provider_meta.get("slack", {}).get("error"),
-                    "rate_limited": provider_meta.get("slack", {}).get("rate_limited", 0),
-                },
-                "drive": {
-                    "timeout": provider_meta.get("drive", {}).get("timeout", False),
-                    "error": provider_meta.get("drive", {}).get("error"),
-                    "rate_limited": provider_meta.get("drive", {}).get("rate_limited", 0),
-                },
-                "github": {
-                    "timeout": provider_meta.get("github", {}).get("timeout", False),
-                    "error": provider_meta.get("github", {}).get("error"),
-                    "rate_limited": provider_meta.get("github", {}).get("rate_limited", 0),
-                },
-            },
+            "timings_ms": {**timings, "fusion": 0, "policy": 0},
+            "provider_flags": flags,
             "candidates": [],
             "chosen": {"url": "", "score": 0.0, "explanations": ["no_providers"]},
             "policy": {"redactions": [], "conflict": False},
-        }
+        })
         # include trace_id in the error payload so you can /trace it
         raise HTTPException(status_code=503, detail={"message": "No providers available", "trace_id": trace_id})
 
     # 5) Fusion: score and choose
     chosen, scores_by_id, reasons_by_id = fusion_rank(candidates, query)
 
-    # 6) Sort by score (desc) for citations
-    sorted_by_score = sorted(candidates, key=lambda c: scores_by_id[c.doc_id], reverse=True)
+    # 6) All candidates by score (desc); policy must redact and check conflicts across every one
+    ranked = sorted(candidates, key=lambda c: scores_by_id[c.doc_id], reverse=True)
 
     # 7) Build citations (top 2–3 distinct URLs)
-    citations: List[Citation] = []
-    seen_urls = set()
-    for c in sorted_by_score:
-        if c.url in seen_urls:
-            continue
-        citations.append(Citation(label=c.source.capitalize(), url=c.url))
-        seen_urls.add(c.url)
-        if len(citations) >= 3:
-            break
+    citations: List[Citation] = [
+        Citation(label=c.source.capitalize(), url=c.url) for c in islice(_distinct_urls(ranked), 3)
+    ]
 
     # 8) Policy: redaction + conflict banner
     chosen_after_policy, redactions, conflict, banner = policy_guard(
-        chosen, sorted_by_score, scores_by_id
+        chosen, ranked, scores_by_id
     )
 
     latency_ms = int((time.perf_counter() - t0) * 1000)
 
     # 9) Confidence (0..1) from chosen score
-    chosen_score = float(scores_by_id[chosen_after_policy.doc_id])
+    chosen_score = scores_by_id[chosen_after_policy.doc_id]
     confidence = max(0.0, min(1.0, chosen_score))
 
     # 10) Freshness from chosen candidate
@@ -218,53 +313,15 @@ async def ask_endpoint(
         policy_banner=(banner or None),
     )
 
-    # 12) Save enriched trace with provider timings/flags
-    TRACE_STORE[trace_id] = {
-        "trace_id": trace_id,
-        "query": query,
-        "timings_ms": {
-            "slack": provider_meta.get("slack", {}).get("ms", 0),
-            "drive": provider_meta.get("drive", {}).get("ms", 0),
-            "github": provider_meta.get("github", {}).get("ms", 0),
-            "fusion": 2,
-            "policy": 1,
-        },
-        "provider_flags": {
-            "slack": {
-                "timeout": provider_meta.get("slack", {}).get("timeout", False),
-                "error": provider_meta.get("slack", {}).get("error"),
-                "rate_limited": provider_meta.get("slack", {}).get("rate_limited", 0),
-            },
-            "drive": {
-                "timeout": provider_meta.get("drive", {}).get("timeout", False),
-                "error": provider_meta.get("drive", {}).get("error"),
-                "rate_limited": provider_meta.get("drive", {}).get("rate_limited", 0),
-            },
-            "github": {
-                "timeout": provider_meta.get("github", {}).get("timeout", False),
-                "error": provider_meta.get("github", {}).get("error"),
-                "rate_limited": provider_meta.get("github", {}).get("rate_limited", 0),
-            },
-        },
-        "candidates": [
-            {
-                "source": c.source,
-                "url": str(c.url),
-                "score": float(scores_by_id[c.doc_id]),
-                "reasons": reasons_by_id[c.doc_id],
-            }
-            for c in sorted_by_score
-        ],
-        "chosen": {
-            "url": str(chosen_after_policy.url),
-            "score": confidence,
-            "explanations": reasons_by_id[chosen_after_policy.doc_id],
-        },
-        "policy": {"redactions": redactions, "conflict": conflict},
-    }
+    # 12) Save enriched trace with provider timings/flags (built only if /trace asks for it)
+    await save_trace_lazy(trace_id, partial(
+        _materialize_trace,
+        trace_id, query, provider_meta, ranked, scores_by_id, reasons_by_id,
+        chosen_after_policy, confidence, redactions, conflict,
+    ))
 
     # 13) QueryLog row (DB)
-    top_sources = {c.source: float(scores_by_id[c.doc_id]) for c in sorted_by_score[:3]}
+    top_sources = {c.source: scores_by_id[c.doc_id] for c in ranked[:3]}
     ql = QueryLog(
         trace_id=trace_id,
         user_id=None,
@@ -272,8 +329,10 @@ async def ask_endpoint(
         top_sources=top_sources,
         latency_ms=latency_ms,
     )
-    db.add(ql)
-    await db.commit()
+    # Committed in batches by the lifespan flusher; keeps a DB round-trip off /ask latency.
+    # If the queue is full, commit it after the response instead of dropping it.
+    if not enqueue_query_log(ql):
+        background.add_task(persist_query_logs, [ql])
 
     # 14) Log
     log_kv(
@@ -294,7 +353,7 @@ async def ask_endpoint(
 # ---------- GET /trace/{trace_id} ----------
 @app.get("/trace/{trace_id}")
 async def get_trace(trace_id: str):
-    trace = TRACE_STORE.get(trace_id)
+    trace = await load_trace(trace_id)
     if not trace:
         raise HTTPException(status_code=404, detail="Trace not found.")
     return trace
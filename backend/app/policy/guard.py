@@ -2,13 +2,14 @@ import re
 from typing import List, Tuple, Dict
 from app.schemas import NormalizedCandidate
 
-# Token redaction patterns (same as before)
-_TOKEN_PATTERNS = [
-    re.compile(r"AKIA[0-9A-Z]{16}"),
-    re.compile(r"xox[pbar]-[0-9A-Za-z-]+"),
-    re.compile(r"Bearer\s+[A-Za-z0-9\._-]+"),
-    re.compile(r"password\s*[:=]\s*\S+", re.IGNORECASE),
-]
+# Token redaction patterns (same as before), as one alternation so each snippet is scanned once.
+# Only the password pattern is case-insensitive, hence the scoped (?i:...) group.
+_TOKEN_RE = re.compile(
+    r"AKIA[0-9A-Z]{16}"
+    r"|xox[pbar]-[0-9A-Za-z-]+"
+    r"|Bearer\s+[A-Za-z0-9\._-]+"
+    r"|(?i:password\s*[:=]\s*\S+)"
+)
 
 # Simple time token (e.g., "3pm", "4 pm") for contradiction check
 _TIME_RE = re.compile(r"\b(1[0-2]|[1-9])\s?pm\b", re.IGNORECASE)
@@ -18,10 +19,7 @@ def _extract_time_token(text: str) -> str:
     return m.group(0).lower() if m else ""
 
 def redact(text: str) -> str:
-    redacted = text or ""
-    for pat in _TOKEN_PATTERNS:
-        redacted = pat.sub("[REDACTED]", redacted)
-    return redacted
+    return _TOKEN_RE.sub("[REDACTED]", text or "")
 
 def guard(
     chosen: NormalizedCandidate,
@@ -60,16 +58,17 @@ def guard(
                 contradictor = c
                 break  # ranked_by_score is sorted DESC by score
     else:
-        # if chosen has no time token, still check others that disagree with each other
-        times = [(c, _extract_time_token(c.snippet)) for c in ranked_by_score]
-        times = [(c, t) for c, t in times if t]
-        seen = {}
-        for c, t in times:
-            if t not in seen:
-                seen[t] = c
-            else:
-                # at least two time tokens, but chosen might lack one; pick the first non-chosen as contradictor
-                contradictor = c if c.doc_id != chosen.doc_id else seen[t]
+        # if chosen has no time token, still check others that disagree with each other:
+        # one pass, each snippet scanned at most once, stop at the second distinct time
+        first_time = ""
+        for c in ranked_by_score:
+            t = _extract_time_token(c.snippet)
+            if not t:
+                continue
+            if not first_time:
+                first_time = t
+            elif t != first_time:
+                contradictor = c
                 break
 
     if contradictor:
@@ -1,53 +1,167 @@
 # app/routers/connections.py
 from __future__ import annotations
 
-import base64
+import hashlib
+import hmac
 import os
 import secrets
+import time
+from dataclasses import dataclass
 from datetime import datetime, timedelta
 from typing import Optional, Dict, Any
 
 import httpx
 from fastapi import APIRouter, HTTPException, Query, Depends, Body
-from fastapi.responses import JSONResponse
-from sqlalchemy import select
+from fastapi.responses import JSONResponse, ORJSONResponse
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+from sqlalchemy import func, select
+from sqlalchemy.dialects.postgresql import insert as _pg_insert
+from sqlalchemy.dialects.sqlite import insert as _sqlite_insert
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.deps import get_db, get_crypto, SessionLocal
+from app.deps import engine, get_db, get_http
 from app.models import Connection, User
+from app.services.cache import TTLCache
+from app.services.crypto import encrypt_str
+from app.services.jsonutil import HAS_ORJSON
+from app.services.status_cache import get_status, invalidate_status, set_status
+from app.services.token_cache import invalidate_token
 
 router = APIRouter(prefix="/connections", tags=["connections"])
 
 # ---------- ENV ----------
-GITHUB_CLIENT_ID = os.getenv("GITHUB_CLIENT_ID")
-GITHUB_CLIENT_SECRET = os.getenv("GITHUB_CLIENT_SECRET")
-GITHUB_CALLBACK_URL = os.getenv("GITHUB_CALLBACK_URL")
+@dataclass(frozen=True, slots=True)
+class OAuthConfig:
+    """One provider's OAuth app settings, read from env once at import."""
+    client_id: str
+    client_secret: str
+    callback_url: str
+    configured: bool  # all three present
 
-SLACK_CLIENT_ID = os.getenv("SLACK_CLIENT_ID")
-SLACK_CLIENT_SECRET = os.getenv("SLACK_CLIENT_SECRET")
-SLACK_CALLBACK_URL = os.getenv("SLACK_CALLBACK_URL")
+    @classmethod
+    def from_env(cls, prefix: str) -> "OAuthConfig":
+        cid = os.getenv(f"{prefix}_CLIENT_ID", "")
+        secret = os.getenv(f"{prefix}_CLIENT_SECRET", "")
+        callback = os.getenv(f"{prefix}_CALLBACK_URL", "")
+        return cls(cid, secret, callback, bool(cid and secret and callback))
 
-GOOGLE_CLIENT_ID = os.getenv("GOOGLE_CLIENT_ID")
-GOOGLE_CLIENT_SECRET = os.getenv("GOOGLE_CLIENT_SECRET")
-GOOGLE_CALLBACK_URL = os.getenv("GOOGLE_CALLBACK_URL")
+
+GITHUB = OAuthConfig.from_env("GITHUB")
+SLACK = OAuthConfig.from_env("SLACK")
+GOOGLE = OAuthConfig.from_env("GOOGLE")
+
+# ---------- OAuth state signing ----------
+OAUTH_STATE_MAX_AGE_S = int(os.getenv("OAUTH_STATE_MAX_AGE_S", "600"))
+
+
+def _state_key() -> bytes:
+    """
+    OAUTH_STATE_SECRET if set. Otherwise a subkey derived from APP_ENCRYPTION_KEY with HKDF,
+    so the token-encryption key is never used directly for a second purpose. With neither,
+    a per-process random key (issued states stop verifying on restart).
+    """
+    dedicated = os.getenv("OAUTH_STATE_SECRET")
+    if dedicated:
+        return dedicated.encode()
+    master = os.getenv("APP_ENCRYPTION_KEY")
+    if not master:
+        return secrets.token_bytes(32)
+    hkdf = HKDF(algorithm=hashes.SHA256(), length=32, salt=None, info=b"onesource:oauth-state:v1")
+    return hkdf.derive(master.encode())
+
+
+_STATE_KEY = _state_key()
+# Nonces already redeemed; entries only need to outlive the max age
+_USED_STATES = TTLCache(ttl_seconds=OAUTH_STATE_MAX_AGE_S, max_entries=10_000)
+
+_PROVIDERS = ("slack", "drive", "github")
+
+# The shared client is tuned for fast search fan-out (1s connect); login must tolerate a slow handshake
+_TOKEN_EXCHANGE_TIMEOUT = httpx.Timeout(15.0, connect=5.0)
+
+# orjson-backed responses when the optional extension is installed
+_StatusResponse = ORJSONResponse if HAS_ORJSON else JSONResponse
+
+# ---------- Authorize URLs (fixed per process except `state`; None when env is missing) ----------
+_SLACK_SCOPES = "channels:read,groups:read,channels:history,groups:history,pins:read,users:read"
+_SLACK_AUTHORIZE_BASE = (
+    "https://slack.com/oauth/v2/authorize"
+    f"?client_id={SLACK.client_id}"
+    f"&redirect_uri={SLACK.callback_url}"
+    f"&scope={_SLACK_SCOPES}"
+) if (SLACK.client_id and SLACK.callback_url) else None
+
+_GOOGLE_SCOPE = httpx.QueryParams({
+    "scope": "https://www.googleapis.com/auth/drive.readonly https://www.googleapis.com/auth/documents.readonly"
+}).get("scope")
+_DRIVE_AUTHORIZE_BASE = (
+    "https://accounts.google.com/o/oauth2/v2/auth"
+    f"?client_id={GOOGLE.client_id}"
+    f"&redirect_uri={GOOGLE.callback_url}"
+    f"&response_type=code"
+    f"&access_type=offline"
+    f"&include_granted_scopes=true"
+    f"&prompt=consent"
+    f"&scope={_GOOGLE_SCOPE}"
+) if (GOOGLE.client_id and GOOGLE.callback_url) else None
+
+_GITHUB_AUTHORIZE_BASE = (
+    "https://github.com/login/oauth/authorize"
+    f"?client_id={GITHUB.client_id}"
+    f"&redirect_uri={GITHUB.callback_url}"
+    "&scope=repo read:user"
+) if (GITHUB.client_id and GITHUB.callback_url) else None
 
 
 # ---------- Helpers ----------
+def _state_mac(payload: str) -> str:
+    return hmac.new(_STATE_KEY, payload.encode(), hashlib.sha256).hexdigest()[:32]
+
 def _make_state() -> str:
-    return base64.urlsafe_b64encode(secrets.token_bytes(24)).decode().rstrip("=")
+    """`nonce.issued_at.mac`: callbacks verify it without a lookup and reject it once expired."""
+    payload = f"{secrets.token_urlsafe(16)}.{int(time.time())}"
+    return f"{payload}.{_state_mac(payload)}"
+
+def _check_state(state: str | None) -> None:
+    """Reject forged, expired or already-redeemed states (single use per process)."""
+    parts = (state or "").split(".")
+    if len(parts) != 3 or not all(parts):
+        raise HTTPException(400, "Invalid OAuth state")
+    nonce, issued_at, mac = parts
+    if not hmac.compare_digest(_state_mac(f"{nonce}.{issued_at}"), mac):
+        raise HTTPException(400, "Invalid OAuth state")
+    try:
+        age = time.time() - int(issued_at)
+    except ValueError:
+        raise HTTPException(400, "Invalid OAuth state")
+    if not -60 <= age <= OAUTH_STATE_MAX_AGE_S:  # small allowance for clock skew between workers
+        raise HTTPException(400, "Expired OAuth state")
+    if _USED_STATES.get(nonce) is not None:
+        raise HTTPException(400, "OAuth state already used")
+    _USED_STATES.set(nonce, True)
+
+# Dialect-specific INSERT ... ON CONFLICT (Postgres in prod, SQLite for local dev)
+_insert = _sqlite_insert if engine.dialect.name == "sqlite" else _pg_insert
+
+# Demo user id is stable for the process lifetime; resolved once
+_DEMO_USER_ID: Optional[int] = None
 
 async def _get_or_create_demo_user(db: AsyncSession) -> int:
     """Hackathon-simple: ensure a demo user exists; return its id."""
+    global _DEMO_USER_ID
+    if _DEMO_USER_ID is not None:
+        return _DEMO_USER_ID
     demo_email = os.getenv("DEMO_USER_EMAIL", "demo@onesource.local")
-    res = await db.execute(select(User).where(User.email == demo_email))
-    user = res.scalar_one_or_none()
-    if user:
-        return user.id
-    user = User(email=demo_email)  # created_at default in model
-    db.add(user)
-    await db.commit()
-    await db.refresh(user)
-    return user.id
+    by_email = select(User.id).where(User.email == demo_email).limit(1)
+    uid = (await db.execute(by_email)).scalar_one_or_none()
+    if uid is None:
+        # Concurrent first callers race safely: the loser's insert is a no-op
+        await db.execute(_insert(User).values(email=demo_email).on_conflict_do_nothing(index_elements=["email"]))
+        await db.commit()
+        uid = (await db.execute(by_email)).scalar_one()
+    _DEMO_USER_ID = uid
+    return uid
 
 async def _upsert_connection(
     db: AsyncSession,
@@ -64,76 +178,75 @@ async def _upsert_connection(
       - access_token_enc / refresh_token_enc are String columns
       - user_id is NOT NULL
       - expires_at is a datetime
+    One INSERT ... ON CONFLICT (user_id, provider) DO UPDATE; existing access/refresh
+    tokens are kept when none is supplied (providers often omit refresh_token on re-auth).
     """
     if user_id is None:
         user_id = await _get_or_create_demo_user(db)
 
-    fernet = get_crypto()
-    access_token_enc = fernet.encrypt(access_token.encode()).decode() if access_token else None
-    refresh_token_enc = fernet.encrypt(refresh_token.encode()).decode() if refresh_token else None
-
-    res = await db.execute(
-        select(Connection).where(Connection.provider == provider, Connection.user_id == user_id)
-    )
-    row = res.scalar_one_or_none()
+    access_token_enc = encrypt_str(access_token) if access_token else None
+    refresh_token_enc = encrypt_str(refresh_token) if refresh_token else None
     now = datetime.utcnow()
 
-    if row:
-        if access_token_enc:
-            row.access_token_enc = access_token_enc
-        row.refresh_token_enc = refresh_token_enc
-        row.scopes = scopes
-        row.expires_at = expires_at_dt
-        row.updated_at = now
-    else:
-        row = Connection(
-            user_id=user_id,
-            provider=provider,
-            access_token_enc=access_token_enc,
-            refresh_token_enc=refresh_token_enc,
-            scopes=scopes,
-            expires_at=expires_at_dt,
-            created_at=now,
-            updated_at=now,
-        )
-        db.add(row)
+    stmt = _insert(Connection).values(
+        user_id=user_id,
+        provider=provider,
+        access_token_enc=access_token_enc,
+        refresh_token_enc=refresh_token_enc,
+        scopes=scopes,
+        expires_at=expires_at_dt,
+        created_at=now,
+        updated_at=now,
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["user_id", "provider"],
+        set_={
+            "access_token_enc": func.coalesce(stmt.excluded.access_token_enc, Connection.access_token_enc),
+            "refresh_token_enc": func.coalesce(stmt.excluded.refresh_token_enc, Connection.refresh_token_enc),
+            "scopes": stmt.excluded.scopes,
+            "expires_at": stmt.excluded.expires_at,
+            "updated_at": now,
+        },
+    )
+    await db.execute(stmt)
     await db.commit()
-
+    # Connectors cache decrypted tokens; drop them so the new token is used right away
+    invalidate_token(provider)
+    invalidate_token(provider, user_id)
+    await invalidate_status(user_id)
 
 # ===========================
 # Slack OAuth
 # ===========================
 @router.post("/slack/authorize")
 async def slack_authorize():
-    if not (SLACK_CLIENT_ID and SLACK_CALLBACK_URL):
+    if not _SLACK_AUTHORIZE_BASE:
         raise HTTPException(500, "Slack env not configured")
     state = _make_state()
-    scopes = "channels:read,groups:read,channels:history,groups:history,pins:read,users:read"
-    url = (
-        "https://slack.com/oauth/v2/authorize"
-        f"?client_id={SLACK_CLIENT_ID}"
-        f"&redirect_uri={SLACK_CALLBACK_URL}"
-        f"&scope={scopes}"
-        f"&state={state}"
-    )
-    return {"authorize_url": url, "state": state}
+    return {"authorize_url": f"{_SLACK_AUTHORIZE_BASE}&state={state}", "state": state}
 
 @router.get("/slack/callback")
-async def slack_callback(code: str, state: str, db: AsyncSession = Depends(get_db)):
-    if not (SLACK_CLIENT_ID and SLACK_CLIENT_SECRET and SLACK_CALLBACK_URL):
+async def slack_callback(
+    code: str,
+    state: str,
+    db: AsyncSession = Depends(get_db),
+    http: httpx.AsyncClient = Depends(get_http),
+):
+    if not SLACK.configured:
         raise HTTPException(500, "Slack env not configured")
-
-    async with httpx.AsyncClient(timeout=15.0) as client:
-        resp = await client.post(
-            "https://slack.com/api/oauth.v2.access",
-            data={
-                "client_id": SLACK_CLIENT_ID,
-                "client_secret": SLACK_CLIENT_SECRET,
-                "code": code,
-                "redirect_uri": SLACK_CALLBACK_URL,
-            },
-            headers={"Content-Type": "application/x-www-form-urlencoded"},
-        )
+    _check_state(state)
+
+    resp = await http.post(
+        "https://slack.com/api/oauth.v2.access",
+        data={
+            "client_id": SLACK.client_id,
+            "client_secret": SLACK.client_secret,
+            "code": code,
+            "redirect_uri": SLACK.callback_url,
+        },
+        headers={"Content-Type": "application/x-www-form-urlencoded"},
+        timeout=_TOKEN_EXCHANGE_TIMEOUT,
+    )
     data = resp.json()
     if not data.get("ok"):
         raise HTTPException(400, f"Slack OAuth failed: {data}")
@@ -183,43 +296,34 @@ async def slack_dev_set_token(payload: Dict[str, Any] = Body(...), db: AsyncSess
 # ===========================
 @router.post("/drive/authorize")
 async def drive_authorize():
-    import httpx as _hx  # just for QueryParams encoding
-    if not (GOOGLE_CLIENT_ID and GOOGLE_CALLBACK_URL):
+    if not _DRIVE_AUTHORIZE_BASE:
         raise HTTPException(500, "Google env not configured")
-
     state = _make_state()
-    scope = "https://www.googleapis.com/auth/drive.readonly https://www.googleapis.com/auth/documents.readonly"
-    qp = _hx.QueryParams({"scope": scope}).get("scope")  # encodes spaces as '+'
-    url = (
-        "https://accounts.google.com/o/oauth2/v2/auth"
-        f"?client_id={GOOGLE_CLIENT_ID}"
-        f"&redirect_uri={GOOGLE_CALLBACK_URL}"
-        f"&response_type=code"
-        f"&access_type=offline"
-        f"&include_granted_scopes=true"
-        f"&scope={qp}"
-        f"&state={state}"
-        f"&prompt=consent"
-    )
-    return {"authorize_url": url, "state": state}
+    return {"authorize_url": f"{_DRIVE_AUTHORIZE_BASE}&state={state}", "state": state}
 
 @router.get("/drive/callback")
-async def drive_callback(code: str, state: str, db: AsyncSession = Depends(get_db)):
-    if not (GOOGLE_CLIENT_ID and GOOGLE_CLIENT_SECRET and GOOGLE_CALLBACK_URL):
+async def drive_callback(
+    code: str,
+    state: str,
+    db: AsyncSession = Depends(get_db),
+    http: httpx.AsyncClient = Depends(get_http),
+):
+    if not GOOGLE.configured:
         raise HTTPException(500, "Google env not configured")
-
-    async with httpx.AsyncClient(timeout=15.0) as client:
-        resp = await client.post(
-            "https://oauth2.googleapis.com/token",
-            data={
-                "code": code,
-                "client_id": GOOGLE_CLIENT_ID,
-                "client_secret": GOOGLE_CLIENT_SECRET,
-                "redirect_uri": GOOGLE_CALLBACK_URL,
-                "grant_type": "authorization_code",
-            },
-            headers={"Content-Type": "application/x-www-form-urlencoded"},
-        )
+    _check_state(state)
+
+    resp = await http.post(
+        "https://oauth2.googleapis.com/token",
+        data={
+            "code": code,
+            "client_id": GOOGLE.client_id,
+            "client_secret": GOOGLE.client_secret,
+            "redirect_uri": GOOGLE.callback_url,
+            "grant_type": "authorization_code",
+        },
+        headers={"Content-Type": "application/x-www-form-urlencoded"},
+        timeout=_TOKEN_EXCHANGE_TIMEOUT,
+    )
     data = resp.json()
     if "access_token" not in data:
         raise HTTPException(400, f"Google OAuth failed: {data}")
@@ -247,36 +351,34 @@ async def drive_callback(code: str, state: str, db: AsyncSession = Depends(get_d
 # ===========================
 @router.post("/github/authorize")
 async def github_authorize():
-    if not (GITHUB_CLIENT_ID and GITHUB_CALLBACK_URL):
+    if not _GITHUB_AUTHORIZE_BASE:
         raise HTTPException(500, "GitHub OAuth not configured")
-    scope = "repo read:user"
     state = _make_state()
-    url = (
-        "https://github.com/login/oauth/authorize"
-        f"?client_id={GITHUB_CLIENT_ID}"
-        f"&redirect_uri={GITHUB_CALLBACK_URL}"
-        f"&scope={scope}"
-        f"&state={state}"
-    )
-    return {"authorize_url": url, "state": state}
+    return {"authorize_url": f"{_GITHUB_AUTHORIZE_BASE}&state={state}", "state": state}
 
 @router.get("/github/callback")
-async def github_callback(code: str = Query(...), state: str | None = None, db: AsyncSession = Depends(get_db)):
-    if not (GITHUB_CLIENT_ID and GITHUB_CLIENT_SECRET and GITHUB_CALLBACK_URL):
+async def github_callback(
+    code: str = Query(...),
+    state: str | None = None,
+    db: AsyncSession = Depends(get_db),
+    http: httpx.AsyncClient = Depends(get_http),
+):
+    if not GITHUB.configured:
         raise HTTPException(500, "GitHub OAuth not configured")
+    _check_state(state)
 
     token_url = "https://github.com/login/oauth/access_token"
-    async with httpx.AsyncClient(timeout=10.0) as client:
-        resp = await client.post(
-            token_url,
-            headers={"Accept": "application/json"},
-            data={
-                "client_id": GITHUB_CLIENT_ID,
-                "client_secret": GITHUB_CLIENT_SECRET,
-                "code": code,
-                "redirect_uri": GITHUB_CALLBACK_URL,
-            },
-        )
+    resp = await http.post(
+        token_url,
+        headers={"Accept": "application/json"},
+        data={
+            "client_id": GITHUB.client_id,
+            "client_secret": GITHUB.client_secret,
+            "code": code,
+            "redirect_uri": GITHUB.callback_url,
+        },
+        timeout=_TOKEN_EXCHANGE_TIMEOUT,
+    )
 
     if resp.status_code != 200:
         raise HTTPException(502, f"Token exchange failed: {resp.text}")
@@ -303,18 +405,24 @@ async def github_callback(code: str = Query(...), state: str | None = None, db:
 # ===========================
 # Connections status
 # ===========================
-@router.get("")
-async def get_connections_status(user_id: int | None = None):
+@router.get("", response_model=None, response_class=_StatusResponse)
+async def get_connections_status(user_id: int | None = None, db: AsyncSession = Depends(get_db)):
     uid = user_id or 1
-    providers = {"slack": False, "drive": False, "github": False}
-    async with SessionLocal() as db:
-        q = await db.execute(
-            select(Connection.provider, Connection.access_token_enc)
-            .where(Connection.user_id == uid)
+    cached = await get_status(uid)
+    if cached is not None:
+        return _StatusResponse(cached)
+    # Only true if a real encrypted token string is saved; the predicate runs in the DB
+    q = await db.execute(
+        select(Connection.provider).where(
+            Connection.user_id == uid,
+            Connection.provider.in_(_PROVIDERS),
+            Connection.access_token_enc.isnot(None),
+            func.trim(Connection.access_token_enc) != "",
+            Connection.access_token_enc != "FAKE_ENCRYPTED",
         )
-        rows = q.fetchall()
-        for prov, enc in rows:
-            # Only true if a real encrypted token string is saved
-            if enc and isinstance(enc, str) and enc.strip() and enc != "FAKE_ENCRYPTED":
-                providers[prov] = True
-    return providers
+    )
+    found = set(q.scalars())
+    status = {p: p in found for p in _PROVIDERS}
+    await set_status(uid, status)
+    # Plain {provider: bool}; returning the response directly skips jsonable_encoder
+    return _StatusResponse(status)
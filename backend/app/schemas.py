@@ -3,7 +3,7 @@ from __future__ import annotations
 from datetime import datetime
 from typing import Dict, List, Literal, Optional
 
-from pydantic import BaseModel, Field, HttpUrl
+from pydantic import BaseModel, Field, HttpUrl, TypeAdapter
 
 
 # ---------- Shared / Connector output ----------
@@ -15,10 +15,11 @@ class NormalizedCandidate(BaseModel):
     """
     Unified shape emitted by each provider adapter (Slack/Drive/GitHub).
     Fusion/Policy operate on this structure only.
+    url stays a plain str internally; it is validated as HttpUrl once, in Citation.
     """
     source: Source
     doc_id: str
-    url: HttpUrl
+    url: str
     title: str
     snippet: str
     last_modified: datetime
@@ -32,6 +33,10 @@ class NormalizedCandidate(BaseModel):
     )
 
 
+# Built once; validates a whole list of candidate dicts in one call
+CANDIDATE_LIST = TypeAdapter(List[NormalizedCandidate])
+
+
 # ---------- /ask response ----------
 
 class Citation(BaseModel):
@@ -55,13 +60,13 @@ class AskResponse(BaseModel):
 
 class CandidateTraceEntry(BaseModel):
     source: Source
-    url: HttpUrl
+    url: str
     score: float
     reasons: List[str] = Field(default_factory=list)
 
 
 class ChosenEntry(BaseModel):
-    url: HttpUrl
+    url: str
     score: float
     explanations: List[str] = Field(default_factory=list)
 
@@ -1,11 +1,17 @@
 # app/services/cache.py
 import time
-from typing import Any, Dict, Tuple
+from collections import OrderedDict
+from functools import lru_cache
+from hashlib import blake2b
+from typing import Any, Tuple
 
 class TTLCache:
-    def __init__(self, ttl_seconds: int = 180):
+    """Bounded LRU with per-entry TTL. Oldest entries are evicted past max_entries."""
+
+    def __init__(self, ttl_seconds: int = 180, max_entries: int = 1024):
         self.ttl = ttl_seconds
-        self.store: Dict[str, Tuple[float, Any]] = {}
+        self.max_entries = max_entries
+        self.store: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
 
     def get(self, key: str) -> Any | None:
         now = time.time()
@@ -16,12 +22,41 @@ class TTLCache:
         if now > expires_at:
             self.store.pop(key, None)
             return None
+        self.store.move_to_end(key)
         return value
 
     def set(self, key: str, value: Any):
-        self.store[key] = (time.time() + self.ttl, value)
+        now = time.time()
+        self.store[key] = (now + self.ttl, value)
+        self.store.move_to_end(key)
+        self._evict(now)
+
+    def _evict(self, now: float) -> None:
+        # Expired entries that are never read again would otherwise sit until pushed out by size;
+        # drop them from the cold (front) end, stopping at the first live one.
+        store = self.store
+        while store:
+            expires_at, _ = next(iter(store.values()))
+            if expires_at > now:
+                break
+            store.popitem(last=False)
+        while len(store) > self.max_entries:
+            store.popitem(last=False)
+
+@lru_cache(maxsize=4096)
+def make_key(user_id: int | None, query: str, *extra: Any) -> str:
+    """
+    Stable cache key for (user, query[, extra...]). The query is case/space-normalized and
+    hashed with blake2b (not hash(), which is salted per process), so keys agree across
+    workers and restarts if the cache moves out of process.
+    """
+    normalized = " ".join((query or "").lower().split())
+    digest = blake2b(normalized.encode(), digest_size=8).hexdigest()
+    return ":".join([str(user_id), *map(str, extra), digest])
 
-# Per-provider caches (use keys like f"{user_id}:{hash(query)}")
+# Per-provider caches (use keys like f"{user_id}:{normalized_query}")
 drive_cache = TTLCache(ttl_seconds=180)   # 3 min
 github_cache = TTLCache(ttl_seconds=180)
 slack_cache = TTLCache(ttl_seconds=120)
+# Slack permalinks never change for a (channel, ts); keyed f"{cid}:{ts}"
+slack_permalink_cache = TTLCache(ttl_seconds=86400, max_entries=10_000)
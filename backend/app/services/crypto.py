@@ -2,38 +2,90 @@
 from __future__ import annotations
 
 import base64
+import ctypes
+import hashlib
 import os
 from typing import List
-from cryptography.fernet import Fernet, MultiFernet
+from cryptography.exceptions import InvalidTag
+from cryptography.fernet import Fernet, InvalidToken, MultiFernet
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+# New tokens are "v2:" + urlsafe_b64(nonce || AES-256-GCM ciphertext+tag).
+# Anything without the prefix is a legacy Fernet token and is still readable.
+_V2_PREFIX = "v2:"
+_NONCE_LEN = 12
 
 _FERNET = None  # singleton
+# bound _FERNET.decrypt, set once with the singleton; saves the lookup + bind per call
+_DECRYPT = None
+_AEADS: List[AESGCM] | None = None  # primary key first, then rotated-out keys
 
 def _coerce_to_fernet_key(raw: str) -> bytes:
     """Accepts either a urlsafe base64 Fernet key (44 chars) or a passphrase."""
     raw = raw.strip()
     if len(raw) == 44:
         return raw.encode()
-    b = raw.encode("utf-8")
-    if len(b) < 32:
-        b = b.ljust(32, b"0")
-    elif len(b) > 32:
-        b = b[:32]
-    return base64.urlsafe_b64encode(b)
+    # truncate or zero-pad to exactly 32 bytes in one expression
+    return base64.urlsafe_b64encode(raw.encode("utf-8")[:32].ljust(32, b"0"))
 
 def get_fernet():
     """
     Lazily construct a Fernet (or MultiFernet) from APP_ENCRYPTION_KEY.
     Never read env at module import; only when this function is called.
     """
-    global _FERNET
+    global _FERNET, _DECRYPT
     if _FERNET is not None:
         return _FERNET
 
+    fernets = [Fernet(_coerce_to_fernet_key(p)) for p in _key_parts()]
+    _FERNET = MultiFernet(fernets) if len(fernets) > 1 else fernets[0]
+    _DECRYPT = _FERNET.decrypt
+    return _FERNET
+
+def _key_parts() -> List[str]:
     key_env = os.getenv("APP_ENCRYPTION_KEY")
     if not key_env:
         raise RuntimeError("APP_ENCRYPTION_KEY not set")
+    return [p for p in key_env.split(",") if p.strip()]
 
-    parts: List[str] = [p for p in key_env.split(",") if p.strip()]
-    fernets = [Fernet(_coerce_to_fernet_key(p)) for p in parts]
-    _FERNET = MultiFernet(fernets) if len(fernets) > 1 else fernets[0]
-    return _FERNET
+def _get_aeads() -> List[AESGCM]:
+    """AES-256-GCM ciphers, one per configured key; the 32-byte key is derived from each part."""
+    global _AEADS
+    if _AEADS is None:
+        _AEADS = [
+            AESGCM(hashlib.sha256(b"onesource-aesgcm-v2:" + _coerce_to_fernet_key(p)).digest())
+            for p in _key_parts()
+        ]
+    return _AEADS
+
+def _zeroize(buf: bytearray) -> None:
+    """Overwrite a plaintext buffer in place (the source str itself is immutable)."""
+    n = len(buf)
+    if n:
+        ctypes.memset((ctypes.c_char * n).from_buffer(buf), 0, n)
+
+def encrypt_str(plain: str) -> str:
+    """Encrypt a token for storage as a str column (AES-256-GCM, "v2:" format)."""
+    nonce = os.urandom(_NONCE_LEN)
+    # Encode into a mutable buffer so the plaintext bytes can be wiped once encrypted
+    buf = bytearray(plain, "utf-8")
+    try:
+        ct = _get_aeads()[0].encrypt(nonce, buf, None)
+    finally:
+        _zeroize(buf)
+    return _V2_PREFIX + base64.urlsafe_b64encode(nonce + ct).decode()
+
+def decrypt_str(token_enc: str) -> str:
+    """Decrypt a stored token string; "v2:" is AES-GCM, anything else is legacy Fernet."""
+    if token_enc.startswith(_V2_PREFIX):
+        raw = base64.urlsafe_b64decode(token_enc[len(_V2_PREFIX):])
+        nonce, ct = raw[:_NONCE_LEN], raw[_NONCE_LEN:]
+        for aead in _get_aeads():
+            try:
+                return aead.decrypt(nonce, ct, None).decode()
+            except InvalidTag:
+                continue
+        raise InvalidToken
+    # Fernet accepts str directly, so no .encode() copy
+    dec = _DECRYPT or get_fernet().decrypt
+    return dec(token_enc).decode()
@@ -0,0 +1,30 @@
+# app/services/deadline.py
+"""
+Per-provider time budget, visible to adapter code. connectorhub sets it around each adapter
+call (alongside its asyncio.timeout); adapters read remaining_s() to avoid starting waits
+that cannot finish in time. Tasks spawned by the adapter inherit it via the context copy.
+"""
+from __future__ import annotations
+
+import asyncio
+import contextvars
+from typing import Optional
+
+_DEADLINE: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar("provider_deadline", default=None)
+
+
+def set_deadline(timeout_s: float) -> contextvars.Token:
+    """Start a budget of `timeout_s` on the running loop's clock; reset with reset_deadline()."""
+    return _DEADLINE.set(asyncio.get_running_loop().time() + timeout_s)
+
+
+def reset_deadline(token: contextvars.Token) -> None:
+    _DEADLINE.reset(token)
+
+
+def remaining_s() -> Optional[float]:
+    """Seconds left in the current budget (may be negative), or None when no budget is set."""
+    deadline = _DEADLINE.get()
+    if deadline is None:
+        return None
+    return deadline - asyncio.get_running_loop().time()
@@ -0,0 +1,17 @@
+# app/services/jsonutil.py
+from __future__ import annotations
+
+# orjson is optional (C-speed parsing); stdlib json accepts the same bytes input
+try:
+    import orjson as _orjson
+    HAS_ORJSON = True
+    loads = _orjson.loads
+    dumps = _orjson.dumps
+except Exception:
+    import json as _json
+    HAS_ORJSON = False
+    loads = _json.loads
+
+    def dumps(obj) -> bytes:
+        # Match orjson: compact separators, bytes out
+        return _json.dumps(obj, separators=(",", ":"), default=str).encode()
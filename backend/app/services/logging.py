@@ -1,9 +1,14 @@
 from __future__ import annotations
 
+import atexit
 import logging
+import queue
+import re
 import sys
+import threading
 import uuid
 import contextvars
+from logging.handlers import QueueHandler, QueueListener
 from typing import Any, Dict
 
 
@@ -27,6 +32,9 @@ def get_trace_id() -> str:
 
 
 # ---- Key=Value formatter ----
+_QUOTE_RE = re.compile(r"[ =]")  # values containing either get quoted
+
+
 class KeyValueFormatter(logging.Formatter):
     """
     Emits single-line key=value pairs for easy grepping and log collection.
@@ -47,24 +55,69 @@ class KeyValueFormatter(logging.Formatter):
         if isinstance(extra_kv, dict):
             kv.update(extra_kv)
 
-        # Render as key=value, quoting values with spaces
-        parts = []
-        for k, v in kv.items():
-            val = str(v)
-            if " " in val or "=" in val:
-                val = f"\"{val}\""
-            parts.append(f"{k}={val}")
-        return " ".join(parts)
+        # Render as key=value, quoting values with spaces or '=' (one scan per value)
+        return " ".join(
+            f'{k}="{val}"' if _QUOTE_RE.search(val := str(v)) else f"{k}={val}"
+            for k, v in kv.items()
+        )
+
+
+# ---- Background writer ----
+class _TraceQueueHandler(QueueHandler):
+    """Enqueue records without blocking; stamps the trace id while still in the request's context."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        if not hasattr(record, "trace_id"):
+            record.trace_id = get_trace_id()
+        return super().prepare(record)
+
+    def format(self, record: logging.LogRecord) -> str:
+        # Merge args only; KeyValueFormatter renders the final single line
+        return record.getMessage()
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        # The writer may have been stopped by an earlier app shutdown (stop_log_listener);
+        # restart it so records are never left in a queue nobody reads
+        if _LISTENER is None:
+            _ensure_listener()
+        super().enqueue(record)
+
+
+_LOG_QUEUE: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+_LISTENER: QueueListener | None = None
+_LISTENER_LOCK = threading.Lock()
+
+
+def _ensure_listener() -> None:
+    """Start the single stdout writer thread on first use (and again after a stop)."""
+    global _LISTENER
+    with _LISTENER_LOCK:
+        if _LISTENER is None:
+            handler = logging.StreamHandler(sys.stdout)
+            handler.setFormatter(KeyValueFormatter())
+            _LISTENER = QueueListener(_LOG_QUEUE, handler)
+            _LISTENER.start()
+
+
+def stop_log_listener() -> None:
+    """Flush queued records and stop the writer thread; safe to call more than once."""
+    global _LISTENER
+    if _LISTENER is not None:
+        listener, _LISTENER = _LISTENER, None
+        listener.stop()
+
+
+atexit.register(stop_log_listener)  # drain queued records on exit
 
 
 # ---- Logger factory & helper ----
 def get_logger(name: str = "app") -> logging.Logger:
     logger = logging.getLogger(name)
     if not logger.handlers:
+        _ensure_listener()
         logger.setLevel(logging.INFO)
-        handler = logging.StreamHandler(sys.stdout)
-        handler.setFormatter(KeyValueFormatter())
-        logger.addHandler(handler)
+        # stdout writes happen on the listener thread, off the event loop
+        logger.addHandler(_TraceQueueHandler(_LOG_QUEUE))
         logger.propagate = False
     return logger
 
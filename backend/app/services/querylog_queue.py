@@ -0,0 +1,84 @@
+# app/services/querylog_queue.py
+"""
+Batched QueryLog writes. /ask enqueues rows; one background flusher commits them in batches
+(up to BATCH_SIZE rows, or whatever arrived within FLUSH_INTERVAL_S) with a single commit.
+The queue is created per lifespan (open_query_log_queue) so it always belongs to the running loop.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+from typing import List, Optional
+
+from app.deps import SessionLocal
+from app.models import QueryLog
+from app.services.logging import get_logger, log_kv
+
+BATCH_SIZE = 50
+FLUSH_INTERVAL_S = 0.5
+QUEUE_MAX = 10_000
+
+LOG = get_logger("backend")
+
+_QUEUE: "Optional[asyncio.Queue[QueryLog]]" = None
+
+
+def open_query_log_queue() -> None:
+    """Create a fresh queue on the current loop; call from lifespan before starting run_flusher()."""
+    global _QUEUE
+    _QUEUE = asyncio.Queue(maxsize=QUEUE_MAX)
+
+
+def enqueue_query_log(ql: QueryLog) -> bool:
+    """Queue a row for the flusher; False if no queue is open or it is full (caller persists it another way)."""
+    if _QUEUE is None:
+        return False
+    try:
+        _QUEUE.put_nowait(ql)
+        return True
+    except asyncio.QueueFull:
+        log_kv(LOG, logging.WARNING, "querylog.queue_full", trace_id=ql.trace_id)
+        return False
+
+
+async def persist_query_logs(batch: List[QueryLog]) -> None:
+    """Insert rows on a fresh session with one commit; failures are logged, not raised."""
+    try:
+        async with SessionLocal() as s:
+            s.add_all(batch)
+            await s.commit()
+    except Exception as e:
+        log_kv(LOG, logging.WARNING, "querylog.persist_failed", rows=len(batch), error=type(e).__name__)
+
+
+async def run_flusher() -> None:
+    """Run for the app's lifetime (started from lifespan); cancel to stop."""
+    queue = _QUEUE
+    if queue is None:
+        raise RuntimeError("open_query_log_queue() must be called before run_flusher()")
+    while True:
+        batch = [await queue.get()]
+        try:
+            async with asyncio.timeout(FLUSH_INTERVAL_S):
+                while len(batch) < BATCH_SIZE:
+                    batch.append(await queue.get())
+        except TimeoutError:
+            pass
+        except asyncio.CancelledError:
+            # shutting down: don't lose the rows already taken off the queue
+            await persist_query_logs(batch)
+            raise
+        await persist_query_logs(batch)
+
+
+async def flush_pending() -> None:
+    """Write whatever is still queued and close the queue (shutdown, after the flusher is cancelled)."""
+    global _QUEUE
+    queue, _QUEUE = _QUEUE, None
+    if queue is None:
+        return
+    while not queue.empty():
+        batch: List[QueryLog] = []
+        while len(batch) < BATCH_SIZE and not queue.empty():
+            batch.append(queue.get_nowait())
+        await persist_query_logs(batch)
@@ -0,0 +1,42 @@
+# app/services/redis_client.py
+"""
+Shared optional Redis client. Active only with REDIS_URL set and the redis package installed;
+otherwise get_redis() returns None and callers fall back to in-process storage.
+"""
+from __future__ import annotations
+
+import logging
+import os
+from typing import Any, Optional
+
+from app.services.logging import get_logger, log_kv
+
+REDIS_URL = os.getenv("REDIS_URL", "")
+
+LOG = get_logger("backend")
+
+try:
+    import redis.asyncio as _aioredis
+except Exception:
+    _aioredis = None
+
+_CLIENT: Any = None
+
+
+def get_redis() -> Optional[Any]:
+    """The process-wide client, built on first use (and again after aclose_redis())."""
+    global _CLIENT
+    if _CLIENT is None and _aioredis is not None and REDIS_URL:
+        _CLIENT = _aioredis.from_url(REDIS_URL)
+    return _CLIENT
+
+
+def log_redis_error(component: str, op: str, e: Exception) -> None:
+    log_kv(LOG, logging.WARNING, f"{component}.redis_error", op=op, error=type(e).__name__)
+
+
+async def aclose_redis() -> None:
+    global _CLIENT
+    client, _CLIENT = _CLIENT, None
+    if client is not None:
+        await client.aclose()
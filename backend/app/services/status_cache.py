@@ -0,0 +1,65 @@
+# app/services/status_cache.py
+"""
+Short-lived cache for GET /connections, keyed by user id only (never the DB session).
+A per-process TTLCache answers repeat polls first; with REDIS_URL set (and the redis package
+installed) Redis backs it so workers share results.
+"""
+from __future__ import annotations
+
+import os
+from typing import Dict, Optional
+
+from app.services.cache import TTLCache
+from app.services.jsonutil import dumps, loads
+from app.services.redis_client import get_redis, log_redis_error
+
+STATUS_TTL_S = int(os.getenv("STATUS_CACHE_TTL_S", "10"))
+# Kept short: another worker's upsert only invalidates its own process-local copy
+STATUS_LOCAL_TTL_S = int(os.getenv("STATUS_LOCAL_TTL_S", "5"))
+
+_LOCAL = TTLCache(ttl_seconds=STATUS_LOCAL_TTL_S, max_entries=1024)
+
+
+def _key(user_id: int) -> str:
+    return f"1src:conn:{user_id}"
+
+
+async def get_status(user_id: int) -> Optional[Dict[str, bool]]:
+    key = _key(user_id)
+    status = _LOCAL.get(key)
+    redis = get_redis()
+    if status is not None or redis is None:
+        return status
+    try:
+        raw = await redis.get(key)
+    except Exception as e:
+        log_redis_error("status_cache", "get", e)
+        return None
+    if raw is None:
+        return None
+    status = loads(raw)
+    _LOCAL.set(key, status)
+    return status
+
+
+async def set_status(user_id: int, status: Dict[str, bool]) -> None:
+    _LOCAL.set(_key(user_id), status)
+    redis = get_redis()
+    if redis is None:
+        return
+    try:
+        await redis.set(_key(user_id), dumps(status), ex=STATUS_TTL_S)
+    except Exception as e:
+        log_redis_error("status_cache", "set", e)
+
+
+async def invalidate_status(user_id: int) -> None:
+    """Call after a connection changes so the next status read goes to the DB."""
+    _LOCAL.store.pop(_key(user_id), None)
+    redis = get_redis()
+    if redis is None:
+        return
+    try:
+        await redis.delete(_key(user_id))
+    except Exception as e:
+        log_redis_error("status_cache", "delete", e)
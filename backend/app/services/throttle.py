@@ -0,0 +1,106 @@
+# app/services/throttle.py
+from __future__ import annotations
+
+import asyncio
+import time
+from collections import deque
+from typing import Deque, Dict
+
+from app.services.deadline import remaining_s
+
+
+class SlidingWindowThrottle:
+    """
+    Proactive per-key rate gate: at most `limit` calls per key in any `window_s` span.
+    wait(key) sleeps until the oldest call in the window ages out instead of letting
+    the provider answer 429. Inside a provider budget (services.deadline) it returns
+    False rather than sleep past the deadline; the caller treats that as rate limited.
+    """
+
+    def __init__(self, limits: Dict[str, int], default: int, window_s: float = 60.0):
+        self.limits = limits
+        self.default = default
+        self.window = window_s
+        self._hits: Dict[str, Deque[float]] = {}
+
+    async def wait(self, key: str) -> bool:
+        limit = self.limits.get(key, self.default)
+        hits = self._hits.setdefault(key, deque())
+        while True:
+            now = time.monotonic()
+            while hits and now - hits[0] >= self.window:
+                hits.popleft()
+            if len(hits) < limit:
+                hits.append(now)
+                return True
+            delay = self.window - (now - hits[0])
+            left = remaining_s()
+            if left is not None and delay >= left:
+                return False
+            await asyncio.sleep(delay)
+
+
+class AIMDLimiter:
+    """
+    Adaptive concurrency gate (additive increase, multiplicative decrease).
+    Fast healthy calls raise the limit by `alpha`; throttled/5xx or slower-than-target
+    calls multiply it by `beta`, at most once per `target_s` so one slow batch of concurrent
+    calls counts as a single congestion signal. Use as `async with limiter:` and feed it
+    via `await record()`.
+    """
+
+    def __init__(
+        self,
+        initial: float = 8.0,
+        c_min: float = 1.0,
+        c_max: float = 32.0,
+        alpha: float = 0.5,
+        beta: float = 0.5,
+        target_s: float = 0.8,
+    ):
+        self.limit = initial
+        self.c_min = c_min
+        self.c_max = c_max
+        self.alpha = alpha
+        self.beta = beta
+        self.target_s = target_s
+        self._in_flight = 0
+        self._last_decrease = float("-inf")
+        # Created on first use per event loop (asyncio primitives bind to one loop)
+        self._cond: asyncio.Condition | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+
+    def _condition(self) -> asyncio.Condition:
+        loop = asyncio.get_running_loop()
+        if self._cond is None or self._loop is not loop:
+            # slots held on a previous loop died with it
+            self._cond, self._loop, self._in_flight = asyncio.Condition(), loop, 0
+        return self._cond
+
+    async def record(self, elapsed_s: float, ok: bool) -> None:
+        if ok and elapsed_s <= self.target_s:
+            before = int(self.limit)
+            self.limit = min(self.c_max, self.limit + self.alpha)
+            if int(self.limit) > before:
+                # a slot opened up; wake waiters now rather than on the next exit
+                cond = self._condition()
+                async with cond:
+                    cond.notify_all()
+            return
+        now = time.monotonic()
+        if now - self._last_decrease >= self.target_s:
+            self._last_decrease = now
+            self.limit = max(self.c_min, self.limit * self.beta)
+
+    async def __aenter__(self) -> "AIMDLimiter":
+        cond = self._condition()
+        async with cond:
+            await cond.wait_for(lambda: self._in_flight < int(self.limit))
+            self._in_flight += 1
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        cond = self._condition()
+        async with cond:
+            self._in_flight -= 1
+            cond.notify_all()
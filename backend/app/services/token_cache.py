@@ -0,0 +1,27 @@
+# app/services/token_cache.py
+from __future__ import annotations
+
+import time
+from typing import Dict, Optional, Tuple
+
+TOKEN_TTL_S = 300.0
+
+# (provider, user_id) -> (decrypted_token, expires_at on the monotonic clock)
+_TOKEN_CACHE: Dict[Tuple[str, int | None], Tuple[str, float]] = {}
+
+
+def get_cached_token(provider: str, user_id: int | None = None) -> Optional[str]:
+    """Return a cached decrypted token, or None if missing/expired."""
+    entry = _TOKEN_CACHE.get((provider, user_id))
+    if entry and entry[1] > time.monotonic():
+        return entry[0]
+    return None
+
+
+def set_cached_token(provider: str, user_id: int | None, token: str) -> None:
+    _TOKEN_CACHE[(provider, user_id)] = (token, time.monotonic() + TOKEN_TTL_S)
+
+
+def invalidate_token(provider: str, user_id: int | None = None) -> None:
+    """Drop a token (e.g. after the provider answered 401) so the next call re-reads the DB."""
+    _TOKEN_CACHE.pop((provider, user_id), None)
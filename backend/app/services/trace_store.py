@@ -0,0 +1,62 @@
+# app/services/trace_store.py
+"""
+Trace persistence behind /trace/{id}.
+With REDIS_URL set (and the redis package installed), traces are stored in Redis with a TTL so
+every worker/replica can serve them. Otherwise they live in this process's bounded TTLCache.
+"""
+from __future__ import annotations
+
+import os
+from typing import Callable, Optional
+
+from app.services.cache import TTLCache
+from app.services.jsonutil import dumps, loads
+from app.services.redis_client import get_redis, log_redis_error
+
+# Bounded working set for the in-process store; the TTL also applies to Redis keys
+TRACE_TTL_S = int(os.getenv("TRACE_TTL_S", "600"))
+TRACE_MAX_ITEMS = int(os.getenv("TRACE_MAX_ITEMS", "4096"))
+
+# Local fallback (and the only store when Redis isn't configured)
+_LOCAL = TTLCache(ttl_seconds=TRACE_TTL_S, max_entries=TRACE_MAX_ITEMS)
+
+
+def _key(trace_id: str) -> str:
+    return f"trace:{trace_id}"
+
+
+async def save_trace(trace_id: str, trace: dict) -> None:
+    redis = get_redis()
+    if redis is not None:
+        try:
+            await redis.set(_key(trace_id), dumps(trace), ex=TRACE_TTL_S)
+            return
+        except Exception as e:
+            log_redis_error("trace_store", "set", e)
+    _LOCAL.set(trace_id, trace)
+
+
+async def save_trace_lazy(trace_id: str, build: Callable[[], dict]) -> None:
+    """
+    Keep a builder instead of the payload; most traces are never fetched.
+    Redis needs bytes, so with Redis configured the trace is built right away.
+    """
+    if get_redis() is not None:
+        await save_trace(trace_id, build())
+        return
+    _LOCAL.set(trace_id, build)
+
+
+async def load_trace(trace_id: str) -> Optional[dict]:
+    redis = get_redis()
+    if redis is not None:
+        try:
+            raw = await redis.get(_key(trace_id))
+            if raw is not None:
+                return loads(raw)
+        except Exception as e:
+            log_redis_error("trace_store", "get", e)
+    # Traces written while Redis was unreachable land here
+    trace = _LOCAL.get(trace_id)
+    return trace() if callable(trace) else trace
+